@@ -0,0 +1,181 @@
+import json
+import sqlite3
+from time import time
+
+from .zone_data import ZoneDataError
+
+
+# Storage shared by LimitZones and the editor: either 'json' (one file per
+# map in the mapdata directory) or 'sqlite' (one database in that directory)
+STORAGE_BACKEND = 'json'
+SQLITE_DATABASE_NAME = "limit_zones.sqlite3"
+
+class JSONBackend:
+    partial_updates = False
+
+    def __init__(self, mapdata_path):
+        self.mapdata_path = mapdata_path
+
+    def get_filepath(self, map_name):
+        return self.mapdata_path / "{basename}.json".format(basename=map_name)
+
+    def load(self, map_name):
+        filepath = self.get_filepath(map_name)
+        if not filepath.isfile():
+            return []
+
+        with open(filepath, 'r') as f:
+            try:
+                json_dict = json.load(f)
+            except ValueError as e:
+                raise ZoneDataError("{}: {}".format(filepath, e))
+
+        if not isinstance(json_dict, dict) or not isinstance(
+                json_dict.get('zones'), list):
+
+            raise ZoneDataError("{}: expected a 'zones' list".format(filepath))
+
+        return [(None, zone_json) for zone_json in json_dict['zones']]
+
+    def save(self, map_name, zone_jsons):
+        zone_jsons = list(zone_jsons)
+        with open(self.get_filepath(map_name), 'w') as f:
+            json.dump({'zones': zone_jsons}, f, indent=4)
+
+        return [None] * len(zone_jsons)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    partial_updates = True
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+
+        # One connection for the lifetime of the plugin; WAL lets several
+        # server instances on the host read while one of them writes
+        self._connection = sqlite3.connect(str(database_path), timeout=5)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+
+        with self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS zones (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    map TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS zones_map ON zones (map, id);
+
+                CREATE TABLE IF NOT EXISTS zone_history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    zone_id INTEGER NOT NULL,
+                    map TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    data TEXT,
+                    time REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS zone_history_zone
+                    ON zone_history (map, zone_id);
+            """)
+
+    def load(self, map_name):
+        return [(zone_id, json.loads(data)) for zone_id, data in
+                self._connection.execute(
+                    "SELECT id, data FROM zones WHERE map = ? ORDER BY id",
+                    (map_name, ))]
+
+    def _insert(self, map_name, zone_json, now):
+        data = json.dumps(zone_json, separators=(',', ':'))
+        zone_id = self._connection.execute(
+            "INSERT INTO zones (map, data) VALUES (?, ?)",
+            (map_name, data)).lastrowid
+
+        self._connection.execute(
+            "INSERT INTO zone_history (zone_id, map, operation, data, time) "
+            "VALUES (?, ?, 'insert', ?, ?)", (zone_id, map_name, data, now))
+
+        return zone_id
+
+    def _delete(self, map_name, zone_ids, now):
+        for zone_id in zone_ids:
+            # Another server sharing the database may have deleted it first
+            if not self._connection.execute(
+                    "DELETE FROM zones WHERE id = ? AND map = ?",
+                    (zone_id, map_name)).rowcount:
+
+                continue
+
+            self._connection.execute(
+                "INSERT INTO zone_history "
+                "(zone_id, map, operation, data, time) "
+                "VALUES (?, ?, 'delete', NULL, ?)", (zone_id, map_name, now))
+
+    def save(self, map_name, zone_jsons):
+        now = time()
+        with self._connection:
+            zone_ids = [zone_id for zone_id, in self._connection.execute(
+                "SELECT id FROM zones WHERE map = ?", (map_name, ))]
+
+            self._delete(map_name, zone_ids, now)
+            return [self._insert(map_name, zone_json, now)
+                    for zone_json in zone_jsons]
+
+    def update(self, map_name, upserts, deletes):
+        now = time()
+        zone_ids = []
+        with self._connection:
+            self._delete(map_name, deletes, now)
+
+            for zone_id, zone_json in upserts:
+                if zone_id is None:
+                    zone_ids.append(self._insert(map_name, zone_json, now))
+                    continue
+
+                data = json.dumps(zone_json, separators=(',', ':'))
+
+                # The row is gone if another server sharing the database
+                # deleted it; the edit is newer, so store the zone again
+                # under a new key
+                if not self._connection.execute(
+                        "UPDATE zones SET data = ? WHERE id = ? AND map = ?",
+                        (data, zone_id, map_name)).rowcount:
+
+                    zone_ids.append(self._insert(map_name, zone_json, now))
+                    continue
+
+                self._connection.execute(
+                    "INSERT INTO zone_history "
+                    "(zone_id, map, operation, data, time) "
+                    "VALUES (?, ?, 'update', ?, ?)",
+                    (zone_id, map_name, data, now))
+
+                zone_ids.append(zone_id)
+
+        return zone_ids
+
+    def history(self, map_name, zone_id=None):
+        if zone_id is None:
+            return self._connection.execute(
+                "SELECT zone_id, operation, data, time FROM zone_history "
+                "WHERE map = ? ORDER BY id", (map_name, )).fetchall()
+
+        return self._connection.execute(
+            "SELECT zone_id, operation, data, time FROM zone_history "
+            "WHERE map = ? AND zone_id = ? ORDER BY id",
+            (map_name, zone_id)).fetchall()
+
+    def close(self):
+        self._connection.close()
+
+
+def create_backend(mapdata_path, name=None):
+    name = name or STORAGE_BACKEND
+    if name == 'json':
+        return JSONBackend(mapdata_path)
+
+    if name == 'sqlite':
+        return SQLiteBackend(mapdata_path / SQLITE_DATABASE_NAME)
+
+    raise ValueError("Unknown storage backend '{}'".format(name))
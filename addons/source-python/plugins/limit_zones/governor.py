@@ -0,0 +1,139 @@
+from collections import Counter
+
+
+# Seconds of LimitZones work per server tick before non-critical work backs
+# off. The plugin overrides this with its TICK_BUDGET setting on load
+DEFAULT_TICK_BUDGET = 0.002
+
+# Smoothing of the per-tick cost, so one slow tick doesn't flip the state
+SMOOTHING = 0.1
+
+# Leave the overloaded state once the cost drops below this share of budget
+RECOVERY_RATIO = 0.75
+
+# While overloaded, the editor redraws this many times less often
+RENDER_THROTTLE = 4
+
+
+class TickGovernor:
+    """Keeps the time LimitZones spends per tick within a budget.
+
+    Restriction enforcement (the run-command listener and touch hooks) is
+    always accounted for and never held back; what it costs decides whether
+    the deferrable work - editor rendering, telemetry flushes - runs.
+    """
+    def __init__(self, budget=DEFAULT_TICK_BUDGET):
+        self.budget = budget
+        self.overloaded = False
+
+        self.average_cost = 0.0
+        self.peak_cost = 0.0
+        self.ticks_measured = 0
+        self.ticks_over_budget = 0
+        self.overload_periods = 0
+        self.deferred = Counter()
+
+        # Estimated cost of one hook call, from the sampled calls
+        self.call_cost = 0.0
+        self._calls = 0
+        self._samples = 0
+        self._sampled_time = 0.0
+
+        self._tick = None
+        self._tick_cost = 0.0
+
+    def charge_calls(self, tick, calls, samples, sampled_time):
+        # Hook calls are too frequent to time each of them: the caller keeps
+        # running totals of all calls and of the few it timed, and charges
+        # them once per tick
+        new_samples = samples - self._samples
+        if new_samples:
+            sample_cost = (sampled_time - self._sampled_time) / new_samples
+            if self._samples:
+                self.call_cost += (sample_cost - self.call_cost) * SMOOTHING
+            else:
+                self.call_cost = sample_cost
+
+        self.charge(tick, (calls - self._calls) * self.call_cost)
+
+        self._calls = calls
+        self._samples = samples
+        self._sampled_time = sampled_time
+
+    def charge(self, tick, seconds):
+        if tick != self._tick:
+            if self._tick is not None:
+                self._end_tick(tick - self._tick)
+
+            self._tick = tick
+
+        self._tick_cost += seconds
+
+    def _end_tick(self, elapsed_ticks):
+        cost = self._tick_cost
+        self._tick_cost = 0.0
+
+        self.ticks_measured += 1
+        if cost > self.budget:
+            self.ticks_over_budget += 1
+
+        if cost > self.peak_cost:
+            self.peak_cost = cost
+
+        # Ticks we didn't run on at all cost nothing
+        if elapsed_ticks > 1:
+            self.average_cost *= (1 - SMOOTHING) ** (elapsed_ticks - 1)
+
+        self.average_cost += (cost - self.average_cost) * SMOOTHING
+
+        if self.overloaded:
+            if self.average_cost < self.budget * RECOVERY_RATIO:
+                self.overloaded = False
+
+        elif self.average_cost > self.budget:
+            self.overloaded = True
+            self.overload_periods += 1
+
+    def should_run(self, task):
+        if not self.overloaded:
+            return True
+
+        self.deferred[task] += 1
+        return False
+
+    def should_run_frame(self, task, frame):
+        # Periodic work runs on every render_throttle'th frame only
+        if frame % self.render_throttle == 0:
+            return True
+
+        self.deferred[task] += 1
+        return False
+
+    @property
+    def render_throttle(self):
+        return RENDER_THROTTLE if self.overloaded else 1
+
+    def get_stats(self):
+        return {
+            'budget': self.budget,
+            'overloaded': self.overloaded,
+            'average_cost': self.average_cost,
+            'call_cost': self.call_cost,
+            'peak_cost': self.peak_cost,
+            'ticks_measured': self.ticks_measured,
+            'ticks_over_budget': self.ticks_over_budget,
+            'overload_periods': self.overload_periods,
+            'deferred': dict(self.deferred),
+        }
+
+    def reset_stats(self):
+        self.peak_cost = 0.0
+        self.ticks_measured = 0
+        self.ticks_over_budget = 0
+        self.overload_periods = 0
+        self.deferred.clear()
+
+
+# Charged by LimitZones and by the editor. The editor resolves it through
+# sys.modules on every use, as reloading LimitZones replaces this module
+governor = TickGovernor()
@@ -1,69 +1,129 @@
+from collections import deque
 import json
+from time import perf_counter, strftime, time
 
-from engines.server import global_vars
+from commands.typed import TypedServerCommand
+from core import echo_console
+from engines.server import global_vars, queue_command_string
 from entities.constants import SolidType
 from entities.entity import Entity
+from entities.helpers import index_from_inthandle
 from entities.hooks import EntityCondition, EntityPostHook, EntityPreHook
 from events import Event
-from listeners import OnEntityDeleted, OnLevelInit, OnPlayerRunCommand
+from filters.players import PlayerIter
+from listeners import (
+    OnClientDisconnect, OnEntityDeleted, OnLevelInit, OnPlayerRunCommand,
+    OnTick)
+from listeners.tick import Delay, TickRepeat
 from mathlib import Vector
 from memory import make_object
-from paths import GAME_PATH
-from players.constants import PlayerButtons
+from paths import GAME_PATH, PLUGIN_DATA_PATH
 from players.dictionary import PlayerDictionary
+from players.helpers import index_from_userid, userid_from_index
 
+from .backends import create_backend
+from .governor import governor
 from .info import info
+from .profiling import ProfileSession
+from .restrictions import PlayerRestrictions
+from .spatial import GridIndex
+from .telemetry import ZoneTelemetry
+from .trace import TraceWriter
+from .zone_data import parse_zone, validate_zone
+from .zone_filters import (
+    build_filter_mask, flag_bit, flag_names, PLAYER_BIT, team_bit, TEAM_MASK)
+from . import zone_logic
 
 
 MAPDATA_PATH = GAME_PATH / "mapdata" / "limit_zones"
 ZONE_ENTITY_CLASSNAME = "trigger_multiple"
+TRACES_PATH = PLUGIN_DATA_PATH / info.basename / "traces"
+TELEMETRY_PATH = PLUGIN_DATA_PATH / info.basename / "telemetry.jsonl"
+RELOAD_SNAPSHOT_PATH = PLUGIN_DATA_PATH / info.basename / "reload.json"
+PROFILES_PATH = PLUGIN_DATA_PATH / info.basename / "profiles"
+
+# lz_reload restores the snapshot only if the plugin is back this quickly
+RELOAD_SNAPSHOT_MAX_AGE = 10
+RELOAD_COMMAND = "sp plugin reload {basename}"
+
+# Seconds per tick LimitZones and the editor may spend before editor
+# rendering and telemetry flushes back off; restrictions always apply
+TICK_BUDGET = 0.002
+
+# Time only one in this many touch hook and run-command calls; the rest are
+# charged to the budget at the sampled calls' average cost
+GOVERNOR_SAMPLE_INTERVAL = 16
+
+# Zones spawned per tick when the plugin is loaded mid-map
+LOAD_SPAWN_BATCH_SIZE = 64
+
+# Record player positions to the trace every this many ticks
+TRACE_POSITION_INTERVAL = 8
+
+# Only spawn triggers for zones near alive players (for huge zone packs)
+LAZY_ZONE_ENTITIES = False
+ACTIVATION_CELL_SIZE = 2048
+ACTIVATION_INTERVAL = 0.5
+
+# Zones are spawned within ACTIVATION_RADIUS cells of a player and only
+# retired once no player is within RETIREMENT_RADIUS cells, so that players
+# walking along a cell border don't make triggers flicker
+ACTIVATION_RADIUS = 1
+RETIREMENT_RADIUS = 2
+
+MAX_PLAYER_INDEX = 256
+
+# Per-zone entry/dwell/restriction counters, appended to TELEMETRY_PATH
+TELEMETRY_ENABLED = False
+TELEMETRY_FLUSH_INTERVAL = 60
+
+# Catch zones that fast players cross between two ticks without touching
+SWEPT_DETECTION = False
+SWEPT_CELL_SIZE = 512
+
+# Longer moves are teleports rather than movement; also keeps the number
+# of looked up cells per player per tick bounded
+SWEPT_MAX_DISTANCE = 256
+
+PLAYER_HULL_MINS = (-16, -16, 0)
+PLAYER_HULL_MAXS = (16, 16, 72)
 
 players = PlayerDictionary()
-nojump_counters = PlayerDictionary(factory=lambda index: 0)
-noduck_counters = PlayerDictionary(factory=lambda index: 0)
-speed_cap_seqs = PlayerDictionary(factory=lambda index: list())
+restrictions = PlayerDictionary(factory=lambda index: PlayerRestrictions())
+previous_origins = PlayerDictionary(factory=lambda index: None)
+touched_zone_entities = PlayerDictionary(factory=lambda index: [])
 
+# Team bit and flags of every player, matched against zone filter masks
+player_masks = [PLAYER_BIT] * (MAX_PLAYER_INDEX + 1)
+hot_reload_requested = False
 
-def dict_to_vector(dict_):
-    return Vector(dict_['x'], dict_['y'], dict_['z'])
+# Running totals for the governor
+hook_calls = 0
+hook_samples = 0
+hook_sampled_time = 0.0
+trace_writer = None
+telemetry = None
 
 
 class Zone:
-    def __init__(self, dict_):
-        mins = dict_to_vector(dict_['mins'])
-        maxs = dict_to_vector(dict_['maxs'])
-        properties = {
-            'nojump': dict_['properties']['nojump'],
-            'noduck': dict_['properties']['noduck'],
-            'speed_cap': dict_['properties']['speed_cap'],
-            'teleport': {
-                'origin': None,
-                'angles': None
-            },
-            'boost': None,
-        }
-
-        if dict_['properties']['teleport']['origin'] is not None:
-            properties['teleport']['origin'] = dict_to_vector(
-                dict_['properties']['teleport']['origin'])
-
-        if dict_['properties']['teleport']['angles'] is not None:
-            properties['teleport']['angles'] = dict_to_vector(
-                dict_['properties']['teleport']['angles'])
-
-        if dict_['properties']['boost'] is not None:
-            properties['boost'] = dict_to_vector(
-                dict_['properties']['boost'])
+    def __init__(self, dict_, zone_id):
+        mins, maxs, properties = parse_zone(dict_, make_vector=Vector)
 
+        self.id = zone_id
         self.mins = mins
         self.maxs = maxs
         self._properties = properties
 
+        # Identifies unchanged zones across hot reloads
+        self.fingerprint = json.dumps(dict_, sort_keys=True)
+        self.filter_mask = build_filter_mask(properties['filter'])
+
     def __getattr__(self, key):
         return self._properties[key]
 
     def __setattr__(self, key, value):
-        if key in ('mins', 'maxs', '_properties'):
+        if key in ('id', 'mins', 'maxs', '_properties', 'fingerprint',
+                   'filter_mask'):
             super().__setattr__(key, value)
         else:
             self._properties[key] = value
@@ -74,22 +134,16 @@ class Zone:
 
 
 class ZonesStorage(list):
-    def load_from_file(self):
-        if not self.filepath.isfile():
-            self.clear()
-            return
+    def load_zones(self):
+        self.clear()
 
-        with open(self.filepath, 'r') as f:
-            json_dict = json.load(f)
+        for zone_id, (key, zone_json) in enumerate(
+                zones_backend.load(global_vars.map_name)):
 
-        for zone_json in json_dict['zones']:
-            self.append(Zone(zone_json))
-
-    @property
-    def filepath(self):
-        return MAPDATA_PATH / "{basename}.json".format(
-            basename=global_vars.map_name)
+            validate_zone(zone_json, "zones[{}]".format(zone_id))
+            self.append(Zone(zone_json, zone_id))
 
+zones_backend = create_backend(MAPDATA_PATH)
 zones_storage = ZonesStorage()
 
 
@@ -97,58 +151,228 @@ class ZoneEntity:
     def __init__(self, entity, zone):
         self.entity = entity
         self.zone = zone
+        self.filter_mask = zone.filter_mask
 
 zone_entities = {}
+spawned_zones = {}
+activation_index = GridIndex(ACTIVATION_CELL_SIZE)
+swept_index = GridIndex(SWEPT_CELL_SIZE)
+
+
+def create_zone_entity(zone):
+    entity = Entity.create(ZONE_ENTITY_CLASSNAME)
+    entity.set_key_value_string(
+        "model", "maps/{map_name}.bsp".format(
+            map_name=global_vars.map_name))
+
+    entity.spawn()
+
+    entity.solid_type = SolidType.BBOX
+
+    mins = Vector(
+        min(zone.mins.x, zone.maxs.x),
+        min(zone.mins.y, zone.maxs.y),
+        min(zone.mins.z, zone.maxs.z)
+    )
+    maxs = Vector(
+        max(zone.mins.x, zone.maxs.x),
+        max(zone.mins.y, zone.maxs.y),
+        max(zone.mins.z, zone.maxs.z)
+    )
+
+    maxs = (maxs - mins) / 2
+    entity.mins = maxs * (-1)
+    entity.maxs = maxs
+    entity.origin = zone.origin
+
+    zone_entities[entity.index] = ZoneEntity(entity, zone)
+    spawned_zones[zone] = entity.index
 
 
 def create_zone_entities():
+    if LAZY_ZONE_ENTITIES:
+        update_active_zones()
+        return
+
     for zone in zones_storage:
-        entity = Entity.create(ZONE_ENTITY_CLASSNAME)
-        entity.set_key_value_string(
-            "model", "maps/{map_name}.bsp".format(
-                map_name=global_vars.map_name))
+        create_zone_entity(zone)
 
-        entity.spawn()
 
-        entity.solid_type = SolidType.BBOX
+def rebuild_zone_indexes():
+    activation_index.clear()
+    swept_index.clear()
 
-        mins = Vector(
-            min(zone.mins.x, zone.maxs.x),
-            min(zone.mins.y, zone.maxs.y),
-            min(zone.mins.z, zone.maxs.z)
-        )
-        maxs = Vector(
-            max(zone.mins.x, zone.maxs.x),
-            max(zone.mins.y, zone.maxs.y),
-            max(zone.mins.z, zone.maxs.z)
-        )
+    # Both indexes only serve opt-in features, don't pay for them otherwise
+    if LAZY_ZONE_ENTITIES:
+        for zone in zones_storage:
+            activation_index.insert(zone, zone.mins, zone.maxs)
+
+    if SWEPT_DETECTION:
+        for zone in zones_storage:
+            zone_logic.insert_swept_zone(
+                swept_index, zone, zone.filter_mask,
+                PLAYER_HULL_MINS, PLAYER_HULL_MAXS)
+
+
+def update_active_zones():
+    wanted_zones = set()
+    kept_zones = set()
+    for player in PlayerIter('alive'):
+        origin = player.origin
+        wanted_zones.update(activation_index.query_around(
+            origin.x, origin.y, origin.z, ACTIVATION_RADIUS))
+
+        kept_zones.update(activation_index.query_around(
+            origin.x, origin.y, origin.z, RETIREMENT_RADIUS))
+
+    for zone, index in tuple(spawned_zones.items()):
+        if zone not in kept_zones:
+            del spawned_zones[zone]
+            zone_entities[index].entity.remove()
+
+    for zone in wanted_zones:
+        if zone not in spawned_zones:
+            create_zone_entity(zone)
+
+
+@TickRepeat
+def activation_repeat():
+    # Zone activation is part of enforcement, so it's measured but never
+    # deferred
+    start = perf_counter()
+    update_active_zones()
+    governor.charge(global_vars.tick_count, perf_counter() - start)
+
+
+pending_spawns = deque()
+
+# Batched spawning after load, reported once the queue is drained
+spawn_count = 0
+spawn_ticks = 0
+spawn_time = 0.0
+
+
+@TickRepeat
+def spawn_repeat():
+    global spawn_count, spawn_ticks, spawn_time
+    start = perf_counter()
+    for i in range(min(LOAD_SPAWN_BATCH_SIZE, len(pending_spawns))):
+        zone = pending_spawns.popleft()
+        if zone not in spawned_zones:
+            create_zone_entity(zone)
+            spawn_count += 1
 
-        maxs = (maxs - mins) / 2
-        entity.mins = maxs * (-1)
-        entity.maxs = maxs
-        entity.origin = zone.origin
+    spawn_time += perf_counter() - start
+    spawn_ticks += 1
 
-        zone_entities[entity.index] = ZoneEntity(entity, zone)
+    if not pending_spawns:
+        spawn_repeat.stop()
+        echo_console(
+            "{name}: spawned {count} zone triggers in {time:.1f} ms over "
+            "{ticks} ticks".format(
+                name=info.name, count=spawn_count, time=spawn_time * 1000,
+                ticks=spawn_ticks))
+
+
+def queue_zone_entities():
+    global spawn_count, spawn_ticks, spawn_time
+    if LAZY_ZONE_ENTITIES:
+        update_active_zones()
+        return
+
+    pending_spawns.clear()
+    pending_spawns.extend(zones_storage)
+    spawn_count = spawn_ticks = 0
+    spawn_time = 0.0
+    spawn_repeat.start(0, limit=0)
 
 
 def load():
+    governor.budget = TICK_BUDGET
+
+    phases = []
+    phase_start = load_start = perf_counter()
+
+    def end_phase(name):
+        nonlocal phase_start
+        phase_end = perf_counter()
+        phases.append("{name} {time:.1f} ms".format(
+            name=name, time=(phase_end - phase_start) * 1000))
+
+        phase_start = phase_end
+
+    for player in PlayerIter():
+        player_masks[player.index] = PLAYER_BIT | team_bit(player.team)
+
     if global_vars.map_name:
-        zones_storage.load_from_file()
-        create_zone_entities()
+        zones_storage.load_zones()
+        end_phase("read")
+
+        rebuild_zone_indexes()
+        end_phase("index")
+
+        snapshot = read_reload_snapshot()
+        if snapshot is not None:
+            restore_reload_snapshot(snapshot)
+            end_phase("restore")
+
+        # Without lazy triggers, the spawning itself is spread over the next
+        # ticks and reported when done
+        queue_zone_entities()
+        end_phase("spawn" if LAZY_ZONE_ENTITIES else "queue")
+
+    if LAZY_ZONE_ENTITIES:
+        activation_repeat.start(ACTIVATION_INTERVAL, limit=0)
+
+    if TELEMETRY_ENABLED:
+        start_telemetry()
+
+    echo_console(
+        "{name}: loaded {zones} zones in {time:.1f} ms ({phases})".format(
+            name=info.name,
+            zones=len(zones_storage),
+            time=(perf_counter() - load_start) * 1000,
+            phases=", ".join(phases)
+        )
+    )
 
 
 def unload():
-    for zone_entity in list(zone_entities.values()):
-        zone_entity.entity.remove()
+    activation_repeat.stop()
+    spawn_repeat.stop()
+    pending_spawns.clear()
+    stop_trace()
+    stop_telemetry()
+    stop_profile()
+
+    # Leave the triggers in place for the reloaded plugin to pick up
+    if hot_reload_requested:
+        write_reload_snapshot()
+    else:
+        for zone_entity in list(zone_entities.values()):
+            zone_entity.entity.remove()
+
+    zones_backend.close()
 
 
 @OnLevelInit
 def listener_on_level_init(level_name):
-    zones_storage.load_from_file()
+    spawn_repeat.stop()
+    pending_spawns.clear()
+
+    if telemetry is not None:
+        telemetry.flush()
+
+    zones_storage.load_zones()
+    rebuild_zone_indexes()
+
+    restrictions.clear()
+    previous_origins.clear()
+    touched_zone_entities.clear()
+    stop_trace()
 
-    nojump_counters.clear()
-    noduck_counters.clear()
-    speed_cap_seqs.clear()
+    if telemetry is not None:
+        telemetry.reset(zones_storage, level_name)
 
 
 @OnEntityDeleted
@@ -156,14 +380,114 @@ def listener_on_entity_deleted(base_entity):
     if not base_entity.is_networked():
         return
 
-    zone_entities.pop(base_entity.index, None)
+    zone_entity = zone_entities.pop(base_entity.index, None)
+    if zone_entity is None:
+        return
+
+    if spawned_zones.get(zone_entity.zone) == base_entity.index:
+        del spawned_zones[zone_entity.zone]
+
+
+@Event('player_team')
+def on_player_team(game_event):
+    try:
+        index = index_from_userid(game_event['userid'])
+    except ValueError:
+        return
+
+    # Keep the flags, replace the team bit
+    player_masks[index] = (
+        player_masks[index] & ~TEAM_MASK | team_bit(game_event['team']))
+
+
+@Event('player_spawn')
+def on_player_spawn(game_event):
+    try:
+        index = index_from_userid(game_event['userid'])
+    except ValueError:
+        return
+
+    # Moving from the death spot isn't movement
+    previous_origins[index] = None
 
 
 @Event('round_start')
 def on_round_start(game_event):
+    spawn_repeat.stop()
+    pending_spawns.clear()
     create_zone_entities()
 
 
+def apply_touch_actions(player, actions):
+    for action in actions:
+        if action[0] == 'teleport':
+            player.teleport(action[1], action[2])
+
+            # Nor is being teleported, so no zones are crossed by it
+            if action[1] is not None:
+                previous_origins[player.index] = None
+        else:
+            player.base_velocity = action[1]
+
+
+def enter_zone(player, zone):
+    apply_touch_actions(
+        player, zone_logic.enter_zone(restrictions[player.index], zone))
+
+    on_zone_entered(player, zone)
+
+
+def on_zone_entered(player, zone):
+    if telemetry is not None:
+        telemetry.enter(player.index, zone.id, global_vars.current_time)
+
+    if trace_writer is not None:
+        trace_writer.start_touch(
+            global_vars.tick_count, player.index, zone.id)
+
+
+def leave_zone(player, zone):
+    zone_logic.leave_zone(restrictions[player.index], zone)
+    on_zone_left(player, zone)
+
+
+def on_zone_left(player, zone):
+    if telemetry is not None:
+        telemetry.leave(player.index, zone.id, global_vars.current_time)
+
+    if trace_writer is not None:
+        trace_writer.end_touch(
+            global_vars.tick_count, player.index, zone.id)
+
+
+def get_crossed_zones(player):
+    origin = player.origin
+    end = (origin.x, origin.y, origin.z)
+    start = previous_origins[player.index]
+    previous_origins[player.index] = end
+
+    if start is None or player.dead:
+        return ()
+
+    return zone_logic.find_crossed_zones(
+        swept_index, start, end, player_masks[player.index],
+        SWEPT_MAX_DISTANCE)
+
+
+def sample_hook_call(function, *args):
+    global hook_samples, hook_sampled_time
+    start = perf_counter()
+    function(*args)
+    hook_sampled_time += perf_counter() - start
+    hook_samples += 1
+
+
+@OnTick
+def listener_on_tick():
+    governor.charge_calls(
+        global_vars.tick_count, hook_calls, hook_samples, hook_sampled_time)
+
+
 _ecx_storage_start_touch = {}
 _ecx_storage_end_touch = {}
 
@@ -182,9 +506,18 @@ def pre_start_touch(args):
     EntityCondition.equals_entity_classname(ZONE_ENTITY_CLASSNAME),
     "start_touch")
 def post_start_touch(args, ret_val):
+    global hook_calls
     entity, other = _ecx_storage_start_touch.pop(
         args.registers.esp.address.address)
 
+    hook_calls += 1
+    if hook_calls % GOVERNOR_SAMPLE_INTERVAL:
+        handle_start_touch(entity, other)
+    else:
+        sample_hook_call(handle_start_touch, entity, other)
+
+
+def handle_start_touch(entity, other):
     try:
         zone_entity = zone_entities[entity.index]
     except KeyError:
@@ -195,26 +528,17 @@ def post_start_touch(args, ret_val):
     except ValueError:
         return
 
-    if zone_entity.zone.teleport['origin'] is not None:
-        if zone_entity.zone.teleport['angles'] is not None:
-            player.teleport(zone_entity.zone.teleport['origin'],
-                            zone_entity.zone.teleport['angles'])
-        else:
-            player.teleport(zone_entity.zone.teleport['origin'])
-    elif zone_entity.zone.teleport['angles'] is not None:
-        player.teleport(None, zone_entity.zone.teleport['angles'])
-
-    if zone_entity.zone.boost is not None:
-        player.base_velocity = zone_entity.zone.boost
+    zone = zone_entity.zone
+    actions = zone_logic.start_touch(
+        restrictions[player.index], touched_zone_entities[player.index],
+        entity.index, zone, zone_entity.filter_mask,
+        player_masks[player.index])
 
-    if zone_entity.zone.nojump:
-        nojump_counters[player.index] += 1
-
-    if zone_entity.zone.noduck:
-        noduck_counters[player.index] += 1
+    if actions is None:
+        return
 
-    if zone_entity.zone.speed_cap is not None:
-        speed_cap_seqs[player.index].append(zone_entity.zone.speed_cap)
+    apply_touch_actions(player, actions)
+    on_zone_entered(player, zone)
 
 
 @EntityPreHook(
@@ -231,9 +555,18 @@ def pre_end_touch(args):
     EntityCondition.equals_entity_classname(ZONE_ENTITY_CLASSNAME),
     "end_touch")
 def post_end_touch(args, ret_val):
+    global hook_calls
     entity, other = _ecx_storage_end_touch.pop(
         args.registers.esp.address.address)
 
+    hook_calls += 1
+    if hook_calls % GOVERNOR_SAMPLE_INTERVAL:
+        handle_end_touch(entity, other)
+    else:
+        sample_hook_call(handle_end_touch, entity, other)
+
+
+def handle_end_touch(entity, other):
     try:
         zone_entity = zone_entities[entity.index]
     except KeyError:
@@ -244,30 +577,344 @@ def post_end_touch(args, ret_val):
     except ValueError:
         return
 
-    if zone_entity.zone.nojump:
-        nojump_counters[player.index] = max(
-            0, nojump_counters[player.index] - 1)
-
-    if zone_entity.zone.noduck:
-        noduck_counters[player.index] = max(
-            0, noduck_counters[player.index] - 1)
+    zone = zone_entity.zone
+    if zone_logic.end_touch(
+            restrictions[player.index], touched_zone_entities[player.index],
+            entity.index, zone):
 
-    if zone_entity.zone.speed_cap is not None:
-        if zone_entity.zone.speed_cap in speed_cap_seqs[player.index]:
-            speed_cap_seqs[player.index].remove(zone_entity.zone.speed_cap)
+        on_zone_left(player, zone)
 
 
 @OnPlayerRunCommand
 def listener_on_player_run_command(player, user_cmd):
-    if nojump_counters[player.index] > 0:
-        user_cmd.buttons &= ~PlayerButtons.JUMP
-
-    if noduck_counters[player.index] > 0:
-        user_cmd.buttons &= ~PlayerButtons.DUCK
-
-    if speed_cap_seqs[player.index]:
-        speed_cap = min(speed_cap_seqs[player.index])
-        if 0 < speed_cap < player.velocity.length:
-            new_velocity = player.velocity
-            new_velocity.length = speed_cap
-            player.base_velocity = new_velocity - player.velocity
+    global hook_calls
+    hook_calls += 1
+    if hook_calls % GOVERNOR_SAMPLE_INTERVAL:
+        enforce_restrictions(player, user_cmd)
+    else:
+        sample_hook_call(enforce_restrictions, player, user_cmd)
+
+
+def enforce_restrictions(player, user_cmd):
+    if SWEPT_DETECTION:
+        crossed_zones = get_crossed_zones(player)
+        for zone in crossed_zones:
+            enter_zone(player, zone)
+    else:
+        crossed_zones = ()
+
+    buttons = user_cmd.buttons
+    filtered_buttons, speed_cap = zone_logic.run_command(
+        restrictions[player.index], buttons)
+
+    if filtered_buttons != buttons:
+        user_cmd.buttons = filtered_buttons
+
+    if trace_writer is not None:
+        tick = global_vars.tick_count
+        trace_writer.run_command(
+            tick, player.index, buttons, filtered_buttons, speed_cap)
+
+        if tick % TRACE_POSITION_INTERVAL == 0:
+            trace_writer.position(
+                tick, player.index, player.origin, player.velocity)
+
+    # Reading the velocity is a property access on the engine; most players
+    # aren't in a speed capped zone
+    speed_corrected = False
+    if speed_cap is not None:
+        base_velocity = zone_logic.correct_velocity(
+            player.velocity, speed_cap)
+
+        if base_velocity is not None:
+            player.base_velocity = Vector(*base_velocity)
+            speed_corrected = True
+
+    if telemetry is not None:
+        telemetry.run_command(
+            player.index, buttons, filtered_buttons, speed_corrected)
+
+    # Crossed zones only apply for the tick the player passed through them
+    for zone in crossed_zones:
+        leave_zone(player, zone)
+
+
+def start_trace():
+    global trace_writer
+    stop_trace()
+
+    TRACES_PATH.makedirs_p()
+    trace_writer = TraceWriter(
+        TRACES_PATH / "{map_name}-{time}.lztrace".format(
+            map_name=global_vars.map_name, time=strftime("%Y%m%d-%H%M%S")),
+        global_vars.map_name,
+        [json.loads(zone.fingerprint) for zone in zones_storage]
+    )
+
+
+def stop_trace():
+    global trace_writer
+    if trace_writer is None:
+        return
+
+    trace_writer.close()
+    echo_console("LimitZones: {records} records written to {path}".format(
+        records=trace_writer.records_written, path=trace_writer.path))
+
+    trace_writer = None
+
+
+@TypedServerCommand('lz_trace_start')
+def typed_lz_trace_start(command_info):
+    start_trace()
+    echo_console("LimitZones: recording trace to {path}".format(
+        path=trace_writer.path))
+
+
+@TypedServerCommand('lz_trace_stop')
+def typed_lz_trace_stop(command_info):
+    stop_trace()
+
+
+profile_session = None
+profile_delay = None
+
+
+def start_profile(duration):
+    global profile_session, profile_delay
+    stop_profile()
+
+    PROFILES_PATH.makedirs_p()
+    profile_session = ProfileSession(
+        PROFILES_PATH / "{map_name}-{time}.prof".format(
+            map_name=global_vars.map_name, time=strftime("%Y%m%d-%H%M%S")))
+
+    profile_session.start()
+    profile_delay = Delay(duration, on_profile_timeout)
+
+
+def on_profile_timeout():
+    global profile_delay
+    profile_delay = None
+    stop_profile()
+
+
+def stop_profile():
+    global profile_session, profile_delay
+    if profile_session is None:
+        return
+
+    if profile_delay is not None:
+        profile_delay.cancel()
+        profile_delay = None
+
+    summary = profile_session.stop()
+    echo_console(summary)
+    echo_console("LimitZones: profile written to {path}".format(
+        path=profile_session.path))
+
+    profile_session = None
+
+
+@TypedServerCommand('lz_profile')
+def typed_lz_profile(command_info, duration:float=10.0):
+    start_profile(duration)
+    echo_console("LimitZones: profiling for {duration:.1f} s".format(
+        duration=duration))
+
+
+@TypedServerCommand('lz_governor_stats')
+def typed_lz_governor_stats(command_info, reset:str=""):
+    stats = governor.get_stats()
+    echo_console(
+        "LimitZones: budget {budget:.2f} ms/tick, average {average:.3f} ms, "
+        "peak {peak:.3f} ms, {call:.1f} us per hook call, {over}/{measured} "
+        "ticks over budget, {periods} overload periods, currently "
+        "{state}".format(
+            budget=stats['budget'] * 1000,
+            average=stats['average_cost'] * 1000,
+            peak=stats['peak_cost'] * 1000,
+            call=stats['call_cost'] * 1000000,
+            over=stats['ticks_over_budget'],
+            measured=stats['ticks_measured'],
+            periods=stats['overload_periods'],
+            state="overloaded" if stats['overloaded'] else "within budget"
+        )
+    )
+
+    for task, count in sorted(stats['deferred'].items()):
+        echo_console("LimitZones: deferred {task} {count} times".format(
+            task=task, count=count))
+
+    if reset == "reset":
+        governor.reset_stats()
+
+
+@TypedServerCommand('lz_profile_stop')
+def typed_lz_profile_stop(command_info):
+    stop_profile()
+
+
+def start_telemetry():
+    global telemetry
+    TELEMETRY_PATH.parent.makedirs_p()
+    telemetry = ZoneTelemetry(TELEMETRY_PATH)
+    telemetry.reset(zones_storage, global_vars.map_name)
+    telemetry_repeat.start(TELEMETRY_FLUSH_INTERVAL, limit=0)
+
+
+def stop_telemetry():
+    global telemetry
+    if telemetry is None:
+        return
+
+    telemetry_repeat.stop()
+    telemetry.close()
+    telemetry = None
+
+
+@TickRepeat
+def telemetry_repeat():
+    # Counters keep accumulating, a deferred flush just goes out later
+    if governor.should_run('telemetry_flush'):
+        telemetry.flush()
+
+
+@OnClientDisconnect
+def listener_on_client_disconnect(index):
+    player_masks[index] = PLAYER_BIT
+
+    if telemetry is not None:
+        telemetry.client_disconnect(index, global_vars.current_time)
+
+
+def write_reload_snapshot():
+    snapshot = {
+        'map': global_vars.map_name,
+        'time': time(),
+        'entities': [],
+        'players': {},
+        'flags': {},
+    }
+
+    for index, zone_entity in zone_entities.items():
+        snapshot['entities'].append(
+            (zone_entity.entity.inthandle, zone_entity.zone.fingerprint))
+
+    for index, entity_indexes in touched_zone_entities.items():
+        snapshot['players'][userid_from_index(index)] = [
+            zone_entities[entity_index].entity.inthandle
+            for entity_index in entity_indexes
+            if entity_index in zone_entities
+        ]
+
+    # Flags set by other plugins; teams are read again from the players
+    for player in PlayerIter():
+        names = flag_names(player_masks[player.index])
+        if names:
+            snapshot['flags'][player.userid] = names
+
+    RELOAD_SNAPSHOT_PATH.parent.makedirs_p()
+    with open(RELOAD_SNAPSHOT_PATH, 'w') as f:
+        json.dump(snapshot, f)
+
+
+def read_reload_snapshot():
+    if not RELOAD_SNAPSHOT_PATH.isfile():
+        return None
+
+    with open(RELOAD_SNAPSHOT_PATH, 'r') as f:
+        snapshot = json.load(f)
+
+    RELOAD_SNAPSHOT_PATH.remove()
+
+    if (snapshot['map'] != global_vars.map_name or
+            time() - snapshot['time'] > RELOAD_SNAPSHOT_MAX_AGE):
+
+        # Nothing will adopt the triggers the old module left behind, and
+        # a full new set is about to be spawned
+        remove_snapshot_entities(snapshot)
+        return None
+
+    return snapshot
+
+
+def remove_snapshot_entities(snapshot):
+    for inthandle, fingerprint in snapshot['entities']:
+        try:
+            index = index_from_inthandle(inthandle)
+        except (OverflowError, ValueError):
+            continue
+
+        # The handle may have been reused since (e.g. after a map change)
+        entity = Entity(index)
+        if entity.classname == ZONE_ENTITY_CLASSNAME:
+            entity.remove()
+
+
+def restore_reload_snapshot(snapshot):
+    zones_by_fingerprint = {}
+    for zone in zones_storage:
+        zones_by_fingerprint.setdefault(zone.fingerprint, []).append(zone)
+
+    # Adopt the triggers of zones that haven't changed, remove the others
+    adopted = {}
+    for inthandle, fingerprint in snapshot['entities']:
+        try:
+            index = index_from_inthandle(inthandle)
+        except (OverflowError, ValueError):
+            continue
+
+        entity = Entity(index)
+        zones = zones_by_fingerprint.get(fingerprint)
+        if not zones:
+            entity.remove()
+            continue
+
+        zone = zones.pop()
+        zone_entities[index] = ZoneEntity(entity, zone)
+        spawned_zones[zone] = index
+        adopted[inthandle] = index
+
+    # Players keep the restrictions of the zones they're standing in; for
+    # zones that were changed, the new triggers will touch them again
+    for userid, inthandles in snapshot['players'].items():
+        try:
+            player_index = index_from_userid(int(userid))
+        except ValueError:
+            continue
+
+        for inthandle in inthandles:
+            index = adopted.get(inthandle)
+            if index is None:
+                continue
+
+            touched_zone_entities[player_index].append(index)
+            restrictions[player_index].start_touch(zone_entities[index].zone)
+
+    for userid, names in snapshot['flags'].items():
+        try:
+            player_index = index_from_userid(int(userid))
+        except ValueError:
+            continue
+
+        for name in names:
+            set_player_flag(player_index, name)
+
+
+@TypedServerCommand('lz_reload')
+def typed_lz_reload(command_info):
+    global hot_reload_requested
+    hot_reload_requested = True
+    queue_command_string(RELOAD_COMMAND.format(basename=info.basename))
+
+
+def set_player_flag(index, name, value=True):
+    if value:
+        player_masks[index] |= flag_bit(name)
+    else:
+        player_masks[index] &= ~flag_bit(name)
+
+
+def get_player_flag(index, name):
+    return bool(player_masks[index] & flag_bit(name))
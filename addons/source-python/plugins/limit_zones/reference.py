@@ -0,0 +1,88 @@
+from collections import defaultdict
+
+from .restrictions import IN_DUCK, IN_JUMP
+
+
+def correct_velocity(velocity, speed_cap):
+    # Vector.length assignment (normalise, then scale) followed by
+    # base_velocity = new_velocity - velocity, as the plugin first did it.
+    # Deliberately not shared with zone_logic, which is what's checked
+    length = (velocity[0] ** 2 + velocity[1] ** 2 + velocity[2] ** 2) ** 0.5
+    if not 0 < speed_cap < length:
+        return None
+
+    return tuple(axis / length * speed_cap - axis for axis in velocity)
+
+
+def touch_actions(zone):
+    # What touching the zone did to the player, in the order it was done
+    actions = []
+    teleport = zone.teleport
+    if teleport['origin'] is not None or teleport['angles'] is not None:
+        actions.append(('teleport', teleport['origin'], teleport['angles']))
+
+    if zone.boost is not None:
+        actions.append(('boost', zone.boost))
+
+    return actions
+
+
+class ReferenceZoneLogic:
+    """Executable model of the original touch and run-command logic.
+
+    Kept exactly as the plugin first implemented it: per-player counters for
+    no-jump and no-duck and a plain list of the speed caps of touched zones,
+    with the effective cap found by min() on every command. Any faster
+    implementation has to produce the same results for the same events,
+    which is what tools/lz_diffcheck.py verifies.
+    """
+    def __init__(self):
+        self.nojump_counters = defaultdict(int)
+        self.noduck_counters = defaultdict(int)
+        self.speed_cap_seqs = defaultdict(list)
+
+    def clear(self):
+        self.nojump_counters.clear()
+        self.noduck_counters.clear()
+        self.speed_cap_seqs.clear()
+
+    def start_touch(self, index, zone):
+        actions = touch_actions(zone)
+
+        if zone.nojump:
+            self.nojump_counters[index] += 1
+
+        if zone.noduck:
+            self.noduck_counters[index] += 1
+
+        if zone.speed_cap is not None:
+            self.speed_cap_seqs[index].append(zone.speed_cap)
+
+        return actions
+
+    def end_touch(self, index, zone):
+        if zone.nojump:
+            self.nojump_counters[index] = max(
+                0, self.nojump_counters[index] - 1)
+
+        if zone.noduck:
+            self.noduck_counters[index] = max(
+                0, self.noduck_counters[index] - 1)
+
+        if zone.speed_cap is not None:
+            if zone.speed_cap in self.speed_cap_seqs[index]:
+                self.speed_cap_seqs[index].remove(zone.speed_cap)
+
+    def run_command(self, index, buttons, velocity):
+        if self.nojump_counters[index] > 0:
+            buttons &= ~IN_JUMP
+
+        if self.noduck_counters[index] > 0:
+            buttons &= ~IN_DUCK
+
+        base_velocity = None
+        if self.speed_cap_seqs[index]:
+            base_velocity = correct_velocity(
+                velocity, min(self.speed_cap_seqs[index]))
+
+        return buttons, base_velocity
@@ -0,0 +1,86 @@
+# Multiset of the speed caps a player is currently subject to. The effective
+# (lowest) cap is kept up to date on every add/discard, so reading it on each
+# tick is a plain attribute access
+class SpeedCaps:
+    __slots__ = ('_counts', 'effective')
+
+    def __init__(self):
+        self._counts = {}
+        self.effective = None
+
+    def __bool__(self):
+        return self.effective is not None
+
+    def add(self, speed_cap):
+        self._counts[speed_cap] = self._counts.get(speed_cap, 0) + 1
+
+        if self.effective is None or speed_cap < self.effective:
+            self.effective = speed_cap
+
+    def discard(self, speed_cap):
+        count = self._counts.get(speed_cap)
+        if count is None:
+            return
+
+        if count > 1:
+            self._counts[speed_cap] = count - 1
+            return
+
+        del self._counts[speed_cap]
+
+        # Only the distinct values need to be looked at, and only when the
+        # last copy of the lowest one is gone
+        if speed_cap == self.effective:
+            self.effective = min(self._counts) if self._counts else None
+
+    def clear(self):
+        self._counts.clear()
+        self.effective = None
+
+
+# Same values as PlayerButtons.JUMP and PlayerButtons.DUCK, duplicated here
+# so that the offline tools can use this module without the game
+IN_JUMP = 1 << 1
+IN_DUCK = 1 << 2
+
+
+class PlayerRestrictions:
+    __slots__ = ('nojump', 'noduck', 'speed_caps')
+
+    def __init__(self):
+        self.nojump = 0
+        self.noduck = 0
+        self.speed_caps = SpeedCaps()
+
+    def start_touch(self, zone):
+        if zone.nojump:
+            self.nojump += 1
+
+        if zone.noduck:
+            self.noduck += 1
+
+        if zone.speed_cap is not None:
+            self.speed_caps.add(zone.speed_cap)
+
+    def end_touch(self, zone):
+        if zone.nojump:
+            self.nojump = max(0, self.nojump - 1)
+
+        if zone.noduck:
+            self.noduck = max(0, self.noduck - 1)
+
+        if zone.speed_cap is not None:
+            self.speed_caps.discard(zone.speed_cap)
+
+    def filter_buttons(self, buttons):
+        if self.nojump > 0:
+            buttons &= ~IN_JUMP
+
+        if self.noduck > 0:
+            buttons &= ~IN_DUCK
+
+        return buttons
+
+    @property
+    def speed_cap(self):
+        return self.speed_caps.effective
@@ -0,0 +1,115 @@
+from math import floor
+
+
+class GridIndex:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self._cells = {}
+
+    def clear(self):
+        self._cells.clear()
+
+    def cell_of(self, x, y, z):
+        cell_size = self.cell_size
+        return (
+            floor(x / cell_size),
+            floor(y / cell_size),
+            floor(z / cell_size)
+        )
+
+    def cells_of_box(self, mins, maxs):
+        min_x, min_y, min_z = self.cell_of(
+            min(mins[0], maxs[0]),
+            min(mins[1], maxs[1]),
+            min(mins[2], maxs[2])
+        )
+        max_x, max_y, max_z = self.cell_of(
+            max(mins[0], maxs[0]),
+            max(mins[1], maxs[1]),
+            max(mins[2], maxs[2])
+        )
+
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                for z in range(min_z, max_z + 1):
+                    yield x, y, z
+
+    def cells_around(self, x, y, z, radius):
+        center_x, center_y, center_z = self.cell_of(x, y, z)
+        for cell_x in range(center_x - radius, center_x + radius + 1):
+            for cell_y in range(center_y - radius, center_y + radius + 1):
+                for cell_z in range(center_z - radius, center_z + radius + 1):
+                    yield cell_x, cell_y, cell_z
+
+    def insert(self, item, mins, maxs):
+        for cell in self.cells_of_box(mins, maxs):
+            self._cells.setdefault(cell, []).append(item)
+
+    def query_cells(self, cells):
+        result = set()
+        for cell in cells:
+            items = self._cells.get(cell)
+            if items is not None:
+                result.update(items)
+
+        return result
+
+    def query_box(self, mins, maxs):
+        return self.query_cells(self.cells_of_box(mins, maxs))
+
+    def query_around(self, x, y, z, radius):
+        return self.query_cells(self.cells_around(x, y, z, radius))
+
+
+def point_in_box(point, mins, maxs):
+    return (mins[0] <= point[0] <= maxs[0] and
+            mins[1] <= point[1] <= maxs[1] and
+            mins[2] <= point[2] <= maxs[2])
+
+
+def segment_intersects_box(start, end, mins, maxs):
+    # Slab test: clip the segment's [0, 1] parameter range against each axis
+    t_enter = 0.0
+    t_exit = 1.0
+    for axis in range(3):
+        origin = start[axis]
+        delta = end[axis] - origin
+        if delta == 0:
+            if origin < mins[axis] or origin > maxs[axis]:
+                return False
+
+            continue
+
+        t_min = (mins[axis] - origin) / delta
+        t_max = (maxs[axis] - origin) / delta
+        if t_min > t_max:
+            t_min, t_max = t_max, t_min
+
+        if t_min > t_enter:
+            t_enter = t_min
+
+        if t_max < t_exit:
+            t_exit = t_max
+
+        if t_enter > t_exit:
+            return False
+
+    return True
+
+
+def box_intersects_box(mins1, maxs1, mins2, maxs2):
+    return (mins1[0] <= maxs2[0] and mins2[0] <= maxs1[0] and
+            mins1[1] <= maxs2[1] and mins2[1] <= maxs1[1] and
+            mins1[2] <= maxs2[2] and mins2[2] <= maxs1[2])
+
+
+def box_distance_sq(point, mins, maxs):
+    # Squared distance from the point to the closest point of the box
+    distance_sq = 0.0
+    for axis in range(3):
+        if point[axis] < mins[axis]:
+            distance_sq += (mins[axis] - point[axis]) ** 2
+        elif point[axis] > maxs[axis]:
+            distance_sq += (point[axis] - maxs[axis]) ** 2
+
+    return distance_sq
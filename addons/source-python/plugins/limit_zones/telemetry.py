@@ -0,0 +1,142 @@
+from array import array
+import json
+from queue import Queue
+from threading import Thread
+from time import time
+
+from .restrictions import IN_DUCK, IN_JUMP
+
+
+MAX_PLAYER_INDEX = 256
+
+
+class ZoneTelemetry:
+    def __init__(self, path):
+        self.path = path
+        self.map_name = None
+        self._previous_buttons = array('l', [0] * (MAX_PLAYER_INDEX + 1))
+        self._inside = [None] * (MAX_PLAYER_INDEX + 1)
+        self.reset((), None)
+
+        # All file I/O happens on this thread, the game thread only queues
+        # ready-made batches
+        self._queue = Queue()
+        self._thread = Thread(target=self._write_batches, daemon=True)
+        self._thread.start()
+
+    def reset(self, zones, map_name):
+        self.map_name = map_name
+        zone_count = len(zones)
+
+        self.entries = array('L', [0] * zone_count)
+        self.dwell_total = array('d', [0.0] * zone_count)
+        self.dwell_max = array('d', [0.0] * zone_count)
+        self.jumps_blocked = array('L', [0] * zone_count)
+        self.ducks_blocked = array('L', [0] * zone_count)
+        self.speed_corrections = array('L', [0] * zone_count)
+
+        self._nojump = bytearray(bool(zone.nojump) for zone in zones)
+        self._noduck = bytearray(bool(zone.noduck) for zone in zones)
+        self._speed_cap = bytearray(
+            zone.speed_cap is not None for zone in zones)
+
+        # Player index -> {zone ID: time of entering}
+        for index in range(len(self._inside)):
+            self._inside[index] = {}
+
+    def enter(self, player_index, zone_id, now):
+        self.entries[zone_id] += 1
+        self._inside[player_index][zone_id] = now
+
+    def leave(self, player_index, zone_id, now):
+        entered = self._inside[player_index].pop(zone_id, None)
+        if entered is None:
+            return
+
+        dwell = now - entered
+        self.dwell_total[zone_id] += dwell
+        if dwell > self.dwell_max[zone_id]:
+            self.dwell_max[zone_id] = dwell
+
+    def run_command(self, player_index, buttons_in, buttons_out,
+                    speed_corrected):
+
+        inside = self._inside[player_index]
+        if not inside:
+            self._previous_buttons[player_index] = buttons_in
+            return
+
+        # Count presses, not the ticks a blocked button is held for
+        pressed = buttons_in & ~self._previous_buttons[player_index]
+        self._previous_buttons[player_index] = buttons_in
+        blocked = pressed & ~buttons_out
+
+        if blocked & IN_JUMP:
+            for zone_id in inside:
+                if self._nojump[zone_id]:
+                    self.jumps_blocked[zone_id] += 1
+
+        if blocked & IN_DUCK:
+            for zone_id in inside:
+                if self._noduck[zone_id]:
+                    self.ducks_blocked[zone_id] += 1
+
+        if speed_corrected:
+            for zone_id in inside:
+                if self._speed_cap[zone_id]:
+                    self.speed_corrections[zone_id] += 1
+
+    def client_disconnect(self, player_index, now):
+        for zone_id in tuple(self._inside[player_index]):
+            self.leave(player_index, zone_id, now)
+
+        self._previous_buttons[player_index] = 0
+
+    def flush(self):
+        now = time()
+        batch = []
+        for zone_id in range(len(self.entries)):
+            if not (self.entries[zone_id] or self.dwell_total[zone_id] or
+                    self.jumps_blocked[zone_id] or
+                    self.ducks_blocked[zone_id] or
+                    self.speed_corrections[zone_id]):
+
+                continue
+
+            batch.append({
+                'time': now,
+                'map': self.map_name,
+                'zone': zone_id,
+                'entries': self.entries[zone_id],
+                'dwell_total': self.dwell_total[zone_id],
+                'dwell_max': self.dwell_max[zone_id],
+                'jumps_blocked': self.jumps_blocked[zone_id],
+                'ducks_blocked': self.ducks_blocked[zone_id],
+                'speed_corrections': self.speed_corrections[zone_id],
+            })
+
+            # Every line holds the counts since the previous flush
+            self.entries[zone_id] = 0
+            self.dwell_total[zone_id] = 0.0
+            self.dwell_max[zone_id] = 0.0
+            self.jumps_blocked[zone_id] = 0
+            self.ducks_blocked[zone_id] = 0
+            self.speed_corrections[zone_id] = 0
+
+        if batch:
+            self._queue.put(batch)
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _write_batches(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+
+            with open(self.path, 'a') as f:
+                for row in batch:
+                    f.write(json.dumps(row, separators=(',', ':')) + "\n")
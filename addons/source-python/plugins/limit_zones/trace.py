@@ -0,0 +1,137 @@
+import json
+from struct import Struct
+
+
+TRACE_MAGIC = b'LZTR'
+TRACE_VERSION = 2
+
+RECORD_START_TOUCH = 1
+RECORD_END_TOUCH = 2
+RECORD_RUN_COMMAND = 3
+RECORD_POSITION = 4
+
+# No speed cap is stored as NaN, as 0 is a valid (if inactive) cap
+NO_SPEED_CAP = float('nan')
+
+_header = Struct('<4sHH')
+
+# Since version 2 the zones the IDs refer to follow the map name, so a trace
+# can be replayed whatever the storage backend or later edits
+_zones_length = Struct('<I')
+_records = {
+    # tick, player index, zone ID
+    RECORD_START_TOUCH: Struct('<BIBI'),
+    RECORD_END_TOUCH: Struct('<BIBI'),
+
+    # tick, player index, buttons in, buttons out, effective speed cap
+    RECORD_RUN_COMMAND: Struct('<BIBiid'),
+
+    # tick, player index, origin, velocity
+    RECORD_POSITION: Struct('<BIB6f'),
+}
+
+
+class TraceWriter:
+    def __init__(self, path, map_name, zones, buffer_size=65536):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.records_written = 0
+        self._buffer = bytearray()
+        self._file = open(path, 'wb')
+
+        map_name = map_name.encode('utf-8')
+        self._buffer += _header.pack(TRACE_MAGIC, TRACE_VERSION, len(map_name))
+        self._buffer += map_name
+
+        zones = json.dumps(zones, separators=(',', ':')).encode('utf-8')
+        self._buffer += _zones_length.pack(len(zones))
+        self._buffer += zones
+
+    def _append(self, record_type, *values):
+        self._buffer += _records[record_type].pack(record_type, *values)
+        self.records_written += 1
+
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def start_touch(self, tick, player_index, zone_id):
+        self._append(RECORD_START_TOUCH, tick, player_index, zone_id)
+
+    def end_touch(self, tick, player_index, zone_id):
+        self._append(RECORD_END_TOUCH, tick, player_index, zone_id)
+
+    def run_command(self, tick, player_index, buttons_in, buttons_out,
+                    speed_cap):
+        if speed_cap is None:
+            speed_cap = NO_SPEED_CAP
+
+        self._append(RECORD_RUN_COMMAND, tick, player_index,
+                     buttons_in, buttons_out, speed_cap)
+
+    def position(self, tick, player_index, origin, velocity):
+        self._append(RECORD_POSITION, tick, player_index,
+                     origin[0], origin[1], origin[2],
+                     velocity[0], velocity[1], velocity[2])
+
+    def flush(self):
+        self._file.write(self._buffer)
+        self._buffer.clear()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+def read_trace(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < _header.size:
+        raise TraceFormatError("{} is too short".format(path))
+
+    magic, version, map_name_length = _header.unpack_from(data)
+    if magic != TRACE_MAGIC:
+        raise TraceFormatError("{} is not a LimitZones trace".format(path))
+
+    if version not in (1, TRACE_VERSION):
+        raise TraceFormatError("{} has unsupported version {}".format(
+            path, version))
+
+    offset = _header.size
+    map_name = data[offset:offset + map_name_length].decode('utf-8')
+    offset += map_name_length
+
+    # None for version 1 traces, which didn't record them
+    zones = None
+    if version >= 2:
+        if offset + _zones_length.size > len(data):
+            raise TraceFormatError("{} is too short".format(path))
+
+        zones_length, = _zones_length.unpack_from(data, offset)
+        offset += _zones_length.size
+        if offset + zones_length > len(data):
+            raise TraceFormatError("{} is too short".format(path))
+
+        zones = json.loads(data[offset:offset + zones_length].decode('utf-8'))
+        offset += zones_length
+
+    records = []
+    end = len(data)
+    while offset < end:
+        record = _records.get(data[offset])
+        if record is None:
+            raise TraceFormatError("Unknown record type {} at {}".format(
+                data[offset], offset))
+
+        # Tolerate a record cut short by a crash
+        if offset + record.size > end:
+            break
+
+        records.append(record.unpack_from(data, offset))
+        offset += record.size
+
+    return map_name, zones, records
@@ -0,0 +1,257 @@
+from numbers import Real
+
+from .zone_filters import TEAM_COUNT
+
+
+class ZoneDataError(Exception):
+    pass
+
+
+def tuple_vector(x, y, z):
+    return x, y, z
+
+
+def dict_to_vector(dict_, make_vector=tuple_vector):
+    return make_vector(dict_['x'], dict_['y'], dict_['z'])
+
+
+def parse_zone(dict_, make_vector=tuple_vector):
+    mins = dict_to_vector(dict_['mins'], make_vector)
+    maxs = dict_to_vector(dict_['maxs'], make_vector)
+    properties = {
+        'nojump': dict_['properties']['nojump'],
+        'noduck': dict_['properties']['noduck'],
+        'speed_cap': dict_['properties']['speed_cap'],
+        'teleport': {
+            'origin': None,
+            'angles': None
+        },
+        'boost': None,
+        'filter': None,
+    }
+
+    if dict_['properties']['teleport']['origin'] is not None:
+        properties['teleport']['origin'] = dict_to_vector(
+            dict_['properties']['teleport']['origin'], make_vector)
+
+    if dict_['properties']['teleport']['angles'] is not None:
+        properties['teleport']['angles'] = dict_to_vector(
+            dict_['properties']['teleport']['angles'], make_vector)
+
+    if dict_['properties']['boost'] is not None:
+        properties['boost'] = dict_to_vector(
+            dict_['properties']['boost'], make_vector)
+
+    # Optional, older files don't have it; validate_zone rejects anything
+    # but lists, a missing or null list is an empty one
+    filter_ = dict_['properties'].get('filter')
+    if filter_ is not None:
+        properties['filter'] = {
+            'teams': list(filter_.get('teams') or ()),
+            'flags': list(filter_.get('flags') or ()),
+        }
+
+    return mins, maxs, properties
+
+
+# Game-independent zone, used by the offline tools
+class ZoneData:
+    def __init__(self, dict_, zone_id=None):
+        self.mins, self.maxs, properties = parse_zone(dict_)
+        self.id = zone_id
+        self.nojump = properties['nojump']
+        self.noduck = properties['noduck']
+        self.speed_cap = properties['speed_cap']
+        self.teleport = properties['teleport']
+        self.boost = properties['boost']
+        self.filter = properties['filter']
+
+
+def _check_vector(dict_, where, nullable=False):
+    if dict_ is None and nullable:
+        return
+
+    if not isinstance(dict_, dict):
+        raise ZoneDataError("{}: expected a vector, got {!r}".format(
+            where, dict_))
+
+    for key in ('x', 'y', 'z'):
+        if key not in dict_:
+            raise ZoneDataError("{}: missing '{}'".format(where, key))
+
+        value = dict_[key]
+        if not isinstance(value, Real) or isinstance(value, bool):
+            raise ZoneDataError("{}.{}: expected a number, got {!r}".format(
+                where, key, value))
+
+
+def _check_key(dict_, key, where):
+    if not isinstance(dict_, dict):
+        raise ZoneDataError("{}: expected an object, got {!r}".format(
+            where, dict_))
+
+    if key not in dict_:
+        raise ZoneDataError("{}: missing '{}'".format(where, key))
+
+    return dict_[key]
+
+
+def validate_zone(dict_, where="zone"):
+    _check_vector(_check_key(dict_, 'mins', where), where + ".mins")
+    _check_vector(_check_key(dict_, 'maxs', where), where + ".maxs")
+
+    properties = _check_key(dict_, 'properties', where)
+    where += ".properties"
+
+    for key in ('nojump', 'noduck'):
+        value = _check_key(properties, key, where)
+        if not isinstance(value, bool):
+            raise ZoneDataError("{}.{}: expected true/false, got {!r}".format(
+                where, key, value))
+
+    speed_cap = _check_key(properties, 'speed_cap', where)
+    if speed_cap is not None and (
+            not isinstance(speed_cap, Real) or isinstance(speed_cap, bool)):
+
+        raise ZoneDataError("{}.speed_cap: expected a number or null, "
+                            "got {!r}".format(where, speed_cap))
+
+    teleport = _check_key(properties, 'teleport', where)
+    _check_vector(_check_key(teleport, 'origin', where + ".teleport"),
+                  where + ".teleport.origin", nullable=True)
+    _check_vector(_check_key(teleport, 'angles', where + ".teleport"),
+                  where + ".teleport.angles", nullable=True)
+
+    _check_vector(_check_key(properties, 'boost', where),
+                  where + ".boost", nullable=True)
+
+    filter_ = properties.get('filter')
+    if filter_ is None:
+        return
+
+    if not isinstance(filter_, dict):
+        raise ZoneDataError("{}.filter: expected an object or null, "
+                            "got {!r}".format(where, filter_))
+
+    for key in ('teams', 'flags'):
+        if not isinstance(filter_.get(key, []), list):
+            raise ZoneDataError("{}.filter.{}: expected a list, got {!r}"
+                                "".format(where, key, filter_[key]))
+
+    for team in filter_.get('teams', ()):
+        if (not isinstance(team, int) or isinstance(team, bool) or
+                not 0 <= team < TEAM_COUNT):
+
+            raise ZoneDataError("{}.filter.teams: invalid team {!r}".format(
+                where, team))
+
+    for flag in filter_.get('flags', ()):
+        if not isinstance(flag, str):
+            raise ZoneDataError("{}.filter.flags: invalid flag {!r}".format(
+                where, flag))
+
+
+def validate_zones(json_dict):
+    zones = _check_key(json_dict, 'zones', "file")
+    if not isinstance(zones, list):
+        raise ZoneDataError("zones: expected a list, got {!r}".format(zones))
+
+    for zone_id, zone_json in enumerate(zones):
+        validate_zone(zone_json, "zones[{}]".format(zone_id))
+
+
+def load_zones(json_dict):
+    validate_zones(json_dict)
+    return [ZoneData(zone_json, zone_id)
+            for zone_id, zone_json in enumerate(json_dict['zones'])]
+
+
+def normalised_box(mins, maxs):
+    return (
+        (min(mins[0], maxs[0]), min(mins[1], maxs[1]), min(mins[2], maxs[2])),
+        (max(mins[0], maxs[0]), max(mins[1], maxs[1]), max(mins[2], maxs[2]))
+    )
+
+
+def _properties_key(zone):
+    return (zone.nojump, zone.noduck, zone.speed_cap,
+            zone.teleport['origin'], zone.teleport['angles'], zone.boost,
+            zone.filter)
+
+
+def lint_zones(zones):
+    warnings = []
+    boxes = []
+    for zone in zones:
+        mins, maxs = normalised_box(zone.mins, zone.maxs)
+        boxes.append((mins, maxs, zone))
+
+        if any(mins[axis] == maxs[axis] for axis in range(3)):
+            warnings.append((zone.id, "degenerate box (zero size)"))
+
+        elif any(zone.mins[axis] > zone.maxs[axis] for axis in range(3)):
+            warnings.append((zone.id, "inverted box (mins > maxs)"))
+
+        if zone.filter is not None and not (
+                zone.filter['teams'] or zone.filter['flags']):
+
+            warnings.append((zone.id, "empty filter, applies to no player"))
+
+    # Sweep along X: only boxes whose X ranges overlap are compared
+    boxes.sort(key=lambda box: box[0][0])
+    active = []
+    for mins, maxs, zone in boxes:
+        active = [box for box in active if box[1][0] >= mins[0]]
+        for other_mins, other_maxs, other in active:
+            if _properties_key(zone) != _properties_key(other):
+                continue
+
+            if (all(other_mins[axis] <= mins[axis] for axis in range(3)) and
+                    all(maxs[axis] <= other_maxs[axis] for axis in range(3))):
+
+                warnings.append((zone.id, "redundant, lies within zone "
+                                          "#{} with the same properties"
+                                          "".format(other.id)))
+
+            elif (all(mins[axis] <= other_mins[axis] for axis in range(3)) and
+                    all(other_maxs[axis] <= maxs[axis] for axis in range(3))):
+
+                warnings.append((other.id, "redundant, lies within zone "
+                                           "#{} with the same properties"
+                                           "".format(zone.id)))
+
+        active.append((mins, maxs, zone))
+
+    warnings.sort(key=lambda warning: warning[0])
+    return warnings
+
+
+def normalise_zone(dict_):
+    (min_x, min_y, min_z), (max_x, max_y, max_z) = normalised_box(
+        (dict_['mins']['x'], dict_['mins']['y'], dict_['mins']['z']),
+        (dict_['maxs']['x'], dict_['maxs']['y'], dict_['maxs']['z'])
+    )
+    properties = dict_['properties']
+
+    def vector(vector_dict):
+        if vector_dict is None:
+            return None
+
+        return {key: float(vector_dict[key]) for key in ('x', 'y', 'z')}
+
+    return {
+        'mins': {'x': float(min_x), 'y': float(min_y), 'z': float(min_z)},
+        'maxs': {'x': float(max_x), 'y': float(max_y), 'z': float(max_z)},
+        'properties': {
+            'nojump': properties['nojump'],
+            'noduck': properties['noduck'],
+            'speed_cap': (None if properties['speed_cap'] is None
+                          else float(properties['speed_cap'])),
+            'teleport': {
+                'origin': vector(properties['teleport']['origin']),
+                'angles': vector(properties['teleport']['angles'])
+            },
+            'boost': vector(properties['boost']),
+            'filter': properties.get('filter'),
+        }
+    }
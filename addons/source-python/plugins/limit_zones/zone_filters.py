@@ -0,0 +1,62 @@
+# A zone filter limits a zone to players on any of the given teams or having
+# any of the given flags (set by other plugins). Filters are precomputed into
+# bitmasks so checking one is a single AND against the player's mask:
+# bits 0-3 hold the team number, bit 4 is set for every player and the
+# following bits are flags.
+TEAM_COUNT = 4
+TEAM_MASK = (1 << TEAM_COUNT) - 1
+
+# Part of every player mask, even before the player's team is known
+PLAYER_BIT = 1 << TEAM_COUNT
+
+# Mask of zones without a filter, matches every player
+FILTER_MASK_ALL = PLAYER_BIT
+
+_flag_bits = {}
+
+
+def team_bit(team):
+    return 1 << team
+
+
+def flag_bit(name):
+    try:
+        return _flag_bits[name]
+    except KeyError:
+        bit = _flag_bits[name] = 1 << (TEAM_COUNT + 1 + len(_flag_bits))
+        return bit
+
+
+def flag_names(mask):
+    # Bits are only allocated for as long as this module lives, so masks
+    # that have to outlive it are stored as names
+    return sorted(name for name, bit in _flag_bits.items() if mask & bit)
+
+
+def build_filter_mask(filter_):
+    if filter_ is None:
+        return FILTER_MASK_ALL
+
+    mask = 0
+    for team in filter_.get('teams', ()):
+        mask |= team_bit(team)
+
+    for name in filter_.get('flags', ()):
+        mask |= flag_bit(name)
+
+    return mask
+
+
+def filter_to_str(filter_):
+    if filter_ is None:
+        return "*"
+
+    parts = []
+    if filter_.get('teams'):
+        parts.append("teams {}".format(
+            ",".join(str(team) for team in filter_['teams'])))
+
+    if filter_.get('flags'):
+        parts.append("flags {}".format(",".join(filter_['flags'])))
+
+    return "; ".join(parts) or "-"
@@ -0,0 +1,101 @@
+# What the touch hooks and the run-command listener decide, kept free of
+# game objects: limit_zones.py applies the results to the player, and
+# tools/lz_diffcheck.py runs the very same functions against the reference
+# model
+from .spatial import point_in_box, segment_intersects_box
+
+
+def touch_actions(zone):
+    # What entering the zone does to the player, in the order it's done
+    actions = []
+    teleport = zone.teleport
+    if teleport['origin'] is not None or teleport['angles'] is not None:
+        actions.append(('teleport', teleport['origin'], teleport['angles']))
+
+    if zone.boost is not None:
+        actions.append(('boost', zone.boost))
+
+    return actions
+
+
+def enter_zone(player_restrictions, zone):
+    player_restrictions.start_touch(zone)
+    return touch_actions(zone)
+
+
+def leave_zone(player_restrictions, zone):
+    player_restrictions.end_touch(zone)
+
+
+def start_touch(player_restrictions, touched, entity_index, zone,
+                filter_mask, player_mask):
+    # None if the zone's filter doesn't match the player
+    if not filter_mask & player_mask:
+        return None
+
+    touched.append(entity_index)
+    return enter_zone(player_restrictions, zone)
+
+
+def end_touch(player_restrictions, touched, entity_index, zone):
+    # Only undo what start_touch applied, even if the player's filter mask
+    # has changed since
+    if entity_index not in touched:
+        return False
+
+    touched.remove(entity_index)
+    leave_zone(player_restrictions, zone)
+    return True
+
+
+def run_command(player_restrictions, buttons):
+    # Returns the filtered buttons and the effective speed cap. The velocity
+    # is only worth reading (from the engine) if there is a cap
+    return (player_restrictions.filter_buttons(buttons),
+            player_restrictions.speed_cap)
+
+
+def correct_velocity(velocity, speed_cap):
+    # The base velocity that brings the player down to the speed cap, or
+    # None if they're within it
+    length = (velocity[0] ** 2 + velocity[1] ** 2 + velocity[2] ** 2) ** 0.5
+    if not 0 < speed_cap < length:
+        return None
+
+    scale = speed_cap / length
+    return tuple(velocity[axis] * scale - velocity[axis] for axis in range(3))
+
+
+def insert_swept_zone(swept_index, zone, filter_mask, hull_mins, hull_maxs):
+    # Player origins are tested against the zone grown by the player hull,
+    # which is what the trigger itself would touch
+    mins = tuple(min(zone.mins[axis], zone.maxs[axis]) - hull_maxs[axis]
+                 for axis in range(3))
+    maxs = tuple(max(zone.mins[axis], zone.maxs[axis]) - hull_mins[axis]
+                 for axis in range(3))
+    swept_index.insert((zone, mins, maxs, filter_mask), mins, maxs)
+
+
+def find_crossed_zones(swept_index, start, end, player_mask, max_distance):
+    distance_sqr = ((end[0] - start[0]) ** 2 + (end[1] - start[1]) ** 2 +
+                    (end[2] - start[2]) ** 2)
+
+    if not 0 < distance_sqr <= max_distance ** 2:
+        return []
+
+    crossed_zones = []
+    for zone, mins, maxs, filter_mask in swept_index.query_box(start, end):
+        if not filter_mask & player_mask:
+            continue
+
+        # If either end is inside, the trigger touches the player by itself
+        if point_in_box(start, mins, maxs) or point_in_box(end, mins, maxs):
+            continue
+
+        if segment_intersects_box(start, end, mins, maxs):
+            crossed_zones.append(zone)
+
+    # The grid returns them in hash order; if several teleport, the last
+    # one has to be the same every time
+    crossed_zones.sort(key=lambda zone: zone.id)
+    return crossed_zones
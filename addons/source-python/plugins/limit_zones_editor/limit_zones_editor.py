@@ -1,58 +1,134 @@
+from collections import deque
 from enum import IntEnum
+from hashlib import sha1
 import json
+import sys
+from time import perf_counter
 
-from colors import BLUE, GREEN, ORANGE
+from colors import BLUE, GREEN, ORANGE, YELLOW
 from commands.typed import TypedClientCommand, TypedSayCommand
-from effects import box
+from core import echo_console
+from effects import beam
 from engines.precache import Model
 from engines.server import global_vars
 from filters.recipients import RecipientFilter
 from listeners import OnClientDisconnect, OnLevelInit
-from listeners.tick import TickRepeat
+from listeners.tick import TickRepeat, TickRepeatStatus
 from mathlib import Vector
 from menus import SimpleMenu, SimpleOption, Text
 from messages import SayText2
-from paths import GAME_PATH
+from paths import GAME_PATH, PLUGIN_DATA_PATH
 from players.dictionary import PlayerDictionary
 
 from advanced_ts import BaseLangStrings
 
+from limit_zones.backends import create_backend, JSONBackend
+from limit_zones.spatial import (
+    box_distance_sq, box_intersects_box, GridIndex)
+from limit_zones.zone_data import (
+    dict_to_vector, parse_zone, validate_zone, ZoneDataError)
+from limit_zones.zone_filters import filter_to_str, TEAM_COUNT
+
 from .info import info
 
 
+init_start = perf_counter()
+
 TICK_REPEAT_INTERVAL = 0.1
 
+# All lines share one model, which is only precached on first use
+LINE_MODEL = Model('sprites/laserbeam.vmt')
+
 EDITOR_LINE_COLOR = GREEN
-EDITOR_LINE_MODEL = Model('sprites/laserbeam.vmt')
+EDITOR_LINE_MODEL = LINE_MODEL
 EDITOR_LINE_WIDTH = 2
 EDITOR_STEP_UNITS = 8
 
 INSPECT_LINE_COLOR = BLUE
-INSPECT_LINE_MODEL = Model('sprites/laserbeam.vmt')
+INSPECT_LINE_MODEL = LINE_MODEL
 INSPECT_LINE_WIDTH = 2
 
 HIGHLIGHT_LINE_COLOR = ORANGE
-HIGHLIGHT_LINE_MODEL = Model('sprites/laserbeam.vmt')
+HIGHLIGHT_LINE_MODEL = LINE_MODEL
 HIGHLIGHT_LINE_WIDTH = 4
 
+SELECTION_LINE_COLOR = YELLOW
+SELECTION_LINE_MODEL = LINE_MODEL
+SELECTION_LINE_WIDTH = 3
+
+# Cell size of the spatial index used to look up zones for selections
+SELECTION_CELL_SIZE = 512
+
+LINE_STYLES = {
+    'editor': (EDITOR_LINE_COLOR, EDITOR_LINE_MODEL, EDITOR_LINE_WIDTH),
+    'inspect': (INSPECT_LINE_COLOR, INSPECT_LINE_MODEL, INSPECT_LINE_WIDTH),
+    'highlight': (
+        HIGHLIGHT_LINE_COLOR, HIGHLIGHT_LINE_MODEL, HIGHLIGHT_LINE_WIDTH),
+    'selection': (
+        SELECTION_LINE_COLOR, SELECTION_LINE_MODEL, SELECTION_LINE_WIDTH),
+}
+
 MAPDATA_PATH = GAME_PATH / "mapdata" / "limit_zones"
 
+# Append every edit to a per-map log that lz_recover can replay after a crash
+EDIT_LOG_ENABLED = False
+EDIT_LOGS_PATH = PLUGIN_DATA_PATH / info.basename / "edit_logs"
+
+# Number of operations lz_undo can go back
+JOURNAL_SIZE = 256
+
 strings = BaseLangStrings(info.basename)
+strings_time = perf_counter() - init_start
+
+
+class LazySayText2:
+    def __init__(self, message):
+        self._message = message
+        self._say_text2 = None
 
-MSG_ERR_INVALID_COORDINATES = SayText2(strings['error invalid_coordinates'])
-MSG_LZ_END_WRONG_ORDER = SayText2(strings['lz_end wrong_order'])
-MSG_LZ_START_WRONG_ORDER = SayText2(strings['lz_start wrong_order'])
-MSG_LZ_INSPECT_START = SayText2(strings['lz_inspect start'])
-MSG_LZ_INSPECT_STOP = SayText2(strings['lz_inspect stop'])
-MSG_ERR_NONE_HIGHLIGHTED = SayText2(strings['error none_highlighted'])
-MSG_ERR_INVALID_ATTACH_TO_ARG = SayText2(
+    def send(self, *player_indexes, **tokens):
+        if self._say_text2 is None:
+            self._say_text2 = SayText2(self._message)
+
+        self._say_text2.send(*player_indexes, **tokens)
+
+
+MSG_ERR_INVALID_COORDINATES = LazySayText2(
+    strings['error invalid_coordinates'])
+MSG_LZ_END_WRONG_ORDER = LazySayText2(strings['lz_end wrong_order'])
+MSG_LZ_START_WRONG_ORDER = LazySayText2(strings['lz_start wrong_order'])
+MSG_LZ_INSPECT_START = LazySayText2(strings['lz_inspect start'])
+MSG_LZ_INSPECT_STOP = LazySayText2(strings['lz_inspect stop'])
+MSG_ERR_NONE_HIGHLIGHTED = LazySayText2(strings['error none_highlighted'])
+MSG_ERR_INVALID_ATTACH_TO_ARG = LazySayText2(
     strings['error invalid_attach_to_arg'])
+MSG_ERR_INVALID_TEAM = LazySayText2(strings['error invalid_team'])
+MSG_ERR_INVALID_ZONES = LazySayText2(strings['error invalid_zones'])
+MSG_ERR_INVALID_EDIT_LOG = LazySayText2(strings['error invalid_edit_log'])
+MSG_LZ_UNDO_EMPTY = LazySayText2(strings['lz_undo empty'])
+MSG_LZ_REDO_EMPTY = LazySayText2(strings['lz_redo empty'])
+MSG_LZ_RECOVER_DONE = LazySayText2(strings['lz_recover done'])
+MSG_LZ_RENDER_STATS = LazySayText2(strings['lz_render_stats'])
+MSG_LZ_SELECT_DONE = LazySayText2(strings['lz_select done'])
+MSG_LZ_BULK_DONE = LazySayText2(strings['lz_bulk done'])
+MSG_ERR_NONE_SELECTED = LazySayText2(strings['error none_selected'])
+MSG_ERR_INVALID_BULK_KEY = LazySayText2(strings['error invalid_bulk_key'])
+MSG_ERR_INVALID_BULK_VALUE = LazySayText2(
+    strings['error invalid_bulk_value'])
 
 
 class IncorrectEditOrder(Exception):
     pass
 
 
+class JournalEmpty(Exception):
+    pass
+
+
+class EditLogError(Exception):
+    pass
+
+
 class InvalidCoordinates(Exception):
     pass
 
@@ -70,8 +146,15 @@ class VectorAttachTo(IntEnum):
     PLAYER_ORIGIN = 2
 
 
+ATTACH_TO_ARGS = {
+    'view': VectorAttachTo.VIEW_COORDINATES,
+    'origin': VectorAttachTo.PLAYER_ORIGIN,
+}
+
+
 players = PlayerDictionary()
 popups = {}
+highlight_popups = {}
 
 
 def round_vector(vector, step):
@@ -88,8 +171,104 @@ def vector_to_dict(vector):
     }
 
 
-def dict_to_vector(dict_):
-    return Vector(dict_['x'], dict_['y'], dict_['z'])
+def normalised_box(mins, maxs):
+    return (
+        Vector(min(mins.x, maxs.x), min(mins.y, maxs.y), min(mins.z, maxs.z)),
+        Vector(max(mins.x, maxs.x), max(mins.y, maxs.y), max(mins.z, maxs.z))
+    )
+
+
+def box_edges(mins, maxs):
+    # Yields the 12 edges of a box as (axis, fixed coordinates, start, end)
+    lo = tuple(min(mins[axis], maxs[axis]) for axis in range(3))
+    hi = tuple(max(mins[axis], maxs[axis]) for axis in range(3))
+    for axis in range(3):
+        axis1, axis2 = (axis + 1) % 3, (axis + 2) % 3
+        for coord1 in (lo[axis1], hi[axis1]):
+            for coord2 in (lo[axis2], hi[axis2]):
+                yield axis, (coord1, coord2), lo[axis], hi[axis]
+
+
+def merge_segments(segments):
+    # Merges overlapping and touching segments lying on the same line
+    segments.sort()
+    merged = [list(segments[0])]
+    for start, end in segments[1:]:
+        if start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def line_point(axis, fixed, value):
+    coords = [0.0, 0.0, 0.0]
+    coords[axis] = value
+    coords[(axis + 1) % 3], coords[(axis + 2) % 3] = fixed
+    return Vector(*coords)
+
+
+class BeamRenderer:
+    """Collects all boxes of one refresh and sends them as few beams.
+
+    Boxes are grouped by recipient filter and line style; inside a group
+    edges lying on the same line are merged, so edges shared by adjacent
+    zones (or a highlighted zone that is also inspected) only go out once.
+    """
+    def __init__(self):
+        # (id(recipients), style) -> (recipients, style, {line: segments})
+        self._groups = {}
+        self.edges_requested = 0
+        self.beams_sent = 0
+        self.last_stats = (0, 0)
+
+    def add_box(self, recipients, style, mins, maxs):
+        if not len(recipients):
+            return
+
+        key = (id(recipients), style)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = (recipients, style, {})
+
+        lines = group[2]
+        for axis, fixed, start, end in box_edges(mins, maxs):
+            lines.setdefault((axis, fixed), []).append((start, end))
+            self.edges_requested += 1
+
+    def flush(self, life_time=TICK_REPEAT_INTERVAL):
+        self.beams_sent = 0
+        for recipients, style, lines in self._groups.values():
+            color, model, width = LINE_STYLES[style]
+            for (axis, fixed), segments in lines.items():
+                for start, end in merge_segments(segments):
+                    if start == end:
+                        continue
+
+                    beam(
+                        recipients,
+                        line_point(axis, fixed, start),
+                        line_point(axis, fixed, end),
+                        color=color,
+                        life_time=life_time,
+                        halo=model,
+                        model=model,
+                        start_width=width,
+                        end_width=width
+                    )
+                    self.beams_sent += 1
+
+        self._groups.clear()
+
+        # Keep the numbers of the last non-empty refresh for lz_render_stats
+        if self.beams_sent:
+            self.last_stats = (self.edges_requested, self.beams_sent)
+
+        self.edges_requested = 0
+
+renderer = BeamRenderer()
 
 
 def vector_to_str(vector):
@@ -100,31 +279,7 @@ class Zone:
     def __init__(self, *args):
         # From JSON-dict
         if isinstance(args[0], dict):
-            dict_ = args[0]
-            mins = dict_to_vector(dict_['mins'])
-            maxs = dict_to_vector(dict_['maxs'])
-            properties = {
-                'nojump': dict_['properties']['nojump'],
-                'noduck': dict_['properties']['noduck'],
-                'speed_cap': dict_['properties']['speed_cap'],
-                'teleport': {
-                    'origin': None,
-                    'angles': None
-                },
-                'boost': None,
-            }
-
-            if dict_['properties']['teleport']['origin'] is not None:
-                properties['teleport']['origin'] = dict_to_vector(
-                    dict_['properties']['teleport']['origin'])
-
-            if dict_['properties']['teleport']['angles'] is not None:
-                properties['teleport']['angles'] = dict_to_vector(
-                    dict_['properties']['teleport']['angles'])
-
-            if dict_['properties']['boost'] is not None:
-                properties['boost'] = dict_to_vector(
-                    dict_['properties']['boost'])
+            mins, maxs, properties = parse_zone(args[0], make_vector=Vector)
 
         # From mins and maxs vectors
         else:
@@ -138,46 +293,50 @@ class Zone:
                     'angles': None
                 },
                 'boost': None,
+                'filter': None,
             }
 
         self.mins = mins
         self.maxs = maxs
         self._properties = properties
+        self._menu_content = None
+
+        # Storage backend key, None until the zone is first saved
+        self.key = None
+        self.dirty = True
 
     def __getattr__(self, key):
         return self._properties[key]
 
     def __setattr__(self, key, value):
-        if key in ('mins', 'maxs', '_properties'):
+        if key in ('mins', 'maxs', '_properties', '_menu_content', 'key',
+                   'dirty'):
+
             super().__setattr__(key, value)
         else:
             self._properties[key] = value
+            self._changed()
+
+    def _changed(self):
+        self._menu_content = None
+        self.dirty = True
+
+    def set_teleport(self, key, value):
+        self._properties['teleport'][key] = value
+        self._changed()
+
+    @property
+    def menu_content(self):
+        if self._menu_content is None:
+            self._menu_content = build_highlight_menu_content(self)
+
+        return self._menu_content
 
     def draw_inspect(self, recipients):
-        box(
-            recipients,
-            self.mins,
-            self.maxs,
-            color=INSPECT_LINE_COLOR,
-            life_time=TICK_REPEAT_INTERVAL,
-            halo=INSPECT_LINE_MODEL,
-            model=INSPECT_LINE_MODEL,
-            start_width=INSPECT_LINE_WIDTH,
-            end_width=INSPECT_LINE_WIDTH
-        )
+        renderer.add_box(recipients, 'inspect', self.mins, self.maxs)
 
     def draw_highlight(self, recipients):
-        box(
-            recipients,
-            self.mins,
-            self.maxs,
-            color=HIGHLIGHT_LINE_COLOR,
-            life_time=TICK_REPEAT_INTERVAL,
-            halo=HIGHLIGHT_LINE_MODEL,
-            model=HIGHLIGHT_LINE_MODEL,
-            start_width=HIGHLIGHT_LINE_WIDTH,
-            end_width=HIGHLIGHT_LINE_WIDTH
-        )
+        renderer.add_box(recipients, 'highlight', self.mins, self.maxs)
 
     @property
     def origin(self):
@@ -196,6 +355,7 @@ class Zone:
                     'angles': None
                 },
                 'boost': None,
+                'filter': self._properties['filter'],
             }
         }
 
@@ -215,33 +375,134 @@ class Zone:
 
 
 class ZonesStorage(list):
-    def save_to_file(self):
-        json_dict = {
-            'zones': [],
-        }
-        for zone in self:
-            json_dict['zones'].append(zone.to_dict())
+    def __init__(self):
+        super().__init__()
+        self._deleted_keys = []
+        self._spatial_index = None
+
+    def pop(self, zone_id=-1):
+        zone = super().pop(zone_id)
+        if zone.key is not None:
+            self._deleted_keys.append(zone.key)
+
+        self._spatial_index = None
+        selections.discard_zone(zone)
+        return zone
+
+    def insert(self, zone_id, zone):
+        # Un-deleted zone, it's not to be deleted from the backend anymore.
+        # If the deletion was saved already (undo survives saves), the zone
+        # has to be stored again
+        if zone.key in self._deleted_keys:
+            self._deleted_keys.remove(zone.key)
+        elif zone.key is not None:
+            zone.dirty = True
+
+        super().insert(zone_id, zone)
+        self._spatial_index = None
+
+    def append(self, zone):
+        super().append(zone)
+        self._spatial_index = None
+
+    def clear(self):
+        super().clear()
+        self._spatial_index = None
+
+    def reorder(self, zones):
+        # Same zones, different IDs
+        super().__setitem__(slice(None), zones)
+        self._spatial_index = None
+
+    def _get_spatial_index(self):
+        # Zone bounds never change, so the index only goes stale when zones
+        # are added or removed
+        if self._spatial_index is None:
+            self._spatial_index = GridIndex(SELECTION_CELL_SIZE)
+            for zone in self:
+                self._spatial_index.insert(zone, zone.mins, zone.maxs)
+
+        return self._spatial_index
+
+    def query_box(self, mins, maxs):
+        lo, hi = normalised_box(mins, maxs)
+        return [
+            zone for zone in self._get_spatial_index().query_box(lo, hi)
+            if box_intersects_box(lo, hi, *normalised_box(
+                zone.mins, zone.maxs))
+        ]
+
+    def query_radius(self, center, radius):
+        offset = Vector(radius, radius, radius)
+        radius_sq = radius ** 2
+        return [
+            zone for zone in self._get_spatial_index().query_box(
+                center - offset, center + offset)
+            if box_distance_sq(center, *normalised_box(
+                zone.mins, zone.maxs)) <= radius_sq
+        ]
+
+    def save_zones(self, backend=None):
+        backend = backend or zones_backend
+
+        # Only send what has changed since the last save, in one transaction
+        if backend.partial_updates and backend is zones_backend:
+            zones = [zone for zone in self if zone.dirty]
+            keys = backend.update(
+                global_vars.map_name,
+                [(zone.key, zone.to_dict()) for zone in zones],
+                self._deleted_keys
+            )
+        else:
+            zones = list(self)
+            keys = backend.save(
+                global_vars.map_name, [zone.to_dict() for zone in zones])
 
-        with open(self.filepath, 'w') as f:
-            json.dump(json_dict, f, indent=4)
+        if backend is zones_backend:
+            for zone, key in zip(zones, keys):
+                zone.key = key
+                zone.dirty = False
 
-    def load_from_file(self):
-        if not self.filepath.isfile():
-            self.clear()
-            return
+            self._deleted_keys.clear()
+
+    def load_zones(self, backend=None):
+        backend = backend or zones_backend
+
+        # Validate everything before touching the zones being edited, so a
+        # broken file doesn't wipe them
+        zone_jsons = backend.load(global_vars.map_name)
+        for zone_id, (key, zone_json) in enumerate(zone_jsons):
+            validate_zone(zone_json, "zones[{}]".format(zone_id))
+
+        if backend is zones_backend:
+            self._deleted_keys.clear()
+        else:
+            # Imported zones replace the stored ones on the next save
+            self._deleted_keys.extend(
+                zone.key for zone in self if zone.key is not None)
 
-        with open(self.filepath, 'r') as f:
-            json_dict = json.load(f)
+        self.unload_zones(keep_deleted_keys=True)
 
-        for zone_json in json_dict['zones']:
-            self.append(Zone(zone_json))
+        for key, zone_json in zone_jsons:
+            zone = Zone(zone_json)
+            if backend is zones_backend:
+                zone.key = key
+                zone.dirty = False
+
+            self.append(zone)
             highlights.append_zone()
 
-    @property
-    def filepath(self):
-        return MAPDATA_PATH / "{basename}.json".format(
-            basename=global_vars.map_name)
+    def unload_zones(self, keep_deleted_keys=False):
+        if not keep_deleted_keys:
+            self._deleted_keys.clear()
 
+        self.clear()
+        highlights.clear()
+        selections.clear()
+
+# The storage setting lives in limit_zones.backends, so that both plugins
+# always read and write the same store
+zones_backend = create_backend(MAPDATA_PATH)
 zones_storage = ZonesStorage()
 
 
@@ -309,9 +570,12 @@ class Highlights(list):
         return None
 
     def append_zone(self):
+        self.insert_zone(len(self))
+
+    def insert_zone(self, zone_id):
         recipients = RecipientFilter()
         recipients.remove_all_players()
-        self.append(recipients)
+        self.insert(zone_id, recipients)
 
     def pop_zone(self, zone_id):
         self.pop(zone_id)
@@ -324,10 +588,34 @@ class Highlights(list):
         for recipients in self:
             recipients.remove_recipient(index)
 
+    def is_active(self):
+        for recipients in self:
+            if len(recipients):
+                return True
+
+        return False
+
 highlights = Highlights()
 
 
 class ZonesEdit(dict):
+    def __init__(self):
+        super().__init__()
+
+        # Preview filters are reused by every refresh while the player edits
+        self._recipients = {}
+
+    def get_recipients(self, index):
+        recipients = self._recipients.get(index)
+        if recipients is None:
+            recipients = self._recipients[index] = RecipientFilter(index)
+
+        return recipients
+
+    def client_disconnect(self, index):
+        self.pop(index, None)
+        self._recipients.pop(index, None)
+
     def start_edit(self, index, attach_to):
         if index in self:
             raise IncorrectEditOrder(
@@ -344,8 +632,9 @@ class ZonesEdit(dict):
         round_vector(start_vector, EDITOR_STEP_UNITS)
 
         self[index] = (attach_to, start_vector)
+        start_drawing()
 
-    def end_edit(self, index):
+    def finish_box(self, index):
         try:
             attach_to, start_vector = self.pop(index)
         except KeyError:
@@ -362,9 +651,10 @@ class ZonesEdit(dict):
 
         round_vector(end_vector, EDITOR_STEP_UNITS)
 
-        zone = Zone(start_vector, end_vector)
-        zones_storage.append(zone)
-        highlights.append_zone()
+        return start_vector, end_vector
+
+    def end_edit(self, index):
+        journal.add_zone(Zone(*self.finish_box(index)))
 
     def cancel_edit(self, index):
         try:
@@ -385,104 +675,482 @@ class ZonesEdit(dict):
 
             round_vector(end_vector, EDITOR_STEP_UNITS)
 
-            box(
-                RecipientFilter(index),
-                start_vector,
-                end_vector,
-                color=EDITOR_LINE_COLOR,
-                life_time=TICK_REPEAT_INTERVAL,
-                halo=EDITOR_LINE_MODEL,
-                model=EDITOR_LINE_MODEL,
-                start_width=EDITOR_LINE_WIDTH,
-                end_width=EDITOR_LINE_WIDTH
-            )
+            renderer.add_box(
+                self.get_recipients(index), 'editor', start_vector, end_vector)
 
 zones_edit = ZonesEdit()
 
 
-def send_highlight_popup(index, zone):
-    if index in popups:
-        popups[index].close(index)
+class Selections(dict):
+    """Sets of zones picked with lz_select or lz_select_radius.
 
-    popup = popups[index] = SimpleMenu(
-        select_callback=select_callback_highlight)
+    Zones are kept by reference rather than by ID, so selections survive
+    zones being added; ZonesStorage drops deleted zones from them.
+    """
+    def __init__(self):
+        super().__init__()
+        self._recipients = {}
 
-    popup.append(SimpleOption(
-            choice_index=1,
-            text=strings['popup highlight next_zone'],
-            value=HighlightChoice.HL_NEXT
-    ))
+    def select(self, index, zones):
+        if zones:
+            self[index] = list(zones)
+            if index not in self._recipients:
+                self._recipients[index] = RecipientFilter(index)
+        else:
+            self.pop(index, None)
 
-    popup.append(SimpleOption(
-        choice_index=2,
-        text=strings['popup highlight prev_zone'],
-        value=HighlightChoice.HL_PREV
-    ))
+    def discard_zone(self, zone):
+        for index, zones in tuple(self.items()):
+            if zone in zones:
+                zones.remove(zone)
+                if not zones:
+                    del self[index]
 
-    if zone is None:
-        popup.append(Text(strings['popup highlight current_zone none']))
+    def tick(self):
+        for index, zones in self.items():
+            recipients = self._recipients[index]
+            for zone in zones:
+                renderer.add_box(recipients, 'selection', zone.mins, zone.maxs)
+
+    def client_disconnect(self, index):
+        self.pop(index, None)
+        self._recipients.pop(index, None)
+
+selections = Selections()
+
+
+def get_zone_value(zone, key):
+    if key == 'teleport_origin':
+        return zone.teleport['origin']
+
+    if key == 'teleport_angles':
+        return zone.teleport['angles']
+
+    return getattr(zone, key)
+
+
+def set_zone_value(zone, key, value):
+    if key == 'teleport_origin':
+        zone.set_teleport('origin', value)
+    elif key == 'teleport_angles':
+        zone.set_teleport('angles', value)
     else:
-        if zone.teleport['origin'] is None:
-            teleport_origin = "- - -"
+        setattr(zone, key, value)
+
+
+VECTOR_KEYS = ('teleport_origin', 'teleport_angles', 'boost')
+
+
+def value_to_json(key, value):
+    if key in VECTOR_KEYS and value is not None:
+        return vector_to_dict(value)
+
+    return value
+
+
+def value_from_json(key, value):
+    if key in VECTOR_KEYS and value is not None:
+        return dict_to_vector(value, make_vector=Vector)
+
+    return value
+
+
+def zone_digest(zone):
+    return sha1(json.dumps(
+        zone.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# Where each settable key lives in a zone's JSON
+ZONE_VALUE_PATHS = {
+    'nojump': ('nojump', ),
+    'noduck': ('noduck', ),
+    'speed_cap': ('speed_cap', ),
+    'teleport_origin': ('teleport', 'origin'),
+    'teleport_angles': ('teleport', 'angles'),
+    'boost': ('boost', ),
+    'filter': ('filter', ),
+}
+
+
+def check_zone_value(zone, key, value_json, where):
+    # Validates the value as part of the zone it's set on
+    try:
+        path = ZONE_VALUE_PATHS[key]
+    except (KeyError, TypeError):
+        raise ZoneDataError("{}: unknown key {!r}".format(where, key))
+
+    dict_ = zone.to_dict()
+    parent = dict_['properties']
+    for part in path[:-1]:
+        parent = parent[part]
+
+    parent[path[-1]] = value_json
+    validate_zone(dict_, where)
+
+
+# Operations are tuples:
+#     ('add', zone_id, zone)
+#     ('delete', zone_id, zone)
+#     ('set', zone, key, old_value, new_value)
+#     ('batch', (operation, ...))
+def invert_operation(operation):
+    if operation[0] == 'add':
+        return ('delete', ) + operation[1:]
+
+    if operation[0] == 'delete':
+        return ('add', ) + operation[1:]
+
+    if operation[0] == 'set':
+        kind, zone, key, old_value, new_value = operation
+        return kind, zone, key, new_value, old_value
+
+    return 'batch', tuple(
+        invert_operation(sub_operation)
+        for sub_operation in reversed(operation[1]))
+
+
+# The edit log refers to zones by their IDs, so its first line records the
+# zones it was started on (digests, in ID order) and it's only replayed
+# onto the same zones:
+#     ["base", [digest, ...]]
+#     ["add", zone_id, zone_json]
+#     ["delete", zone_id]
+#     ["set", zone_id, key, value_json]
+class EditJournal:
+    def __init__(self):
+        self._undo = deque(maxlen=JOURNAL_SIZE)
+        self._redo = []
+        self._log = None
+        self._log_base = []
+        self._log_started = False
+
+    def add_zone(self, zone):
+        self.execute(('add', len(zones_storage), zone))
+
+    def delete_zone(self, zone_id):
+        self.execute(('delete', zone_id, zones_storage[zone_id]))
+
+    def set_value(self, zone_id, key, value):
+        zone = zones_storage[zone_id]
+        self.execute(('set', zone, key, get_zone_value(zone, key), value))
+
+    def set_values(self, zones, key, value):
+        self.execute(('batch', tuple(
+            ('set', zone, key, get_zone_value(zone, key), value)
+            for zone in zones
+        )))
+
+    def delete_zones(self, zones):
+        # Removing from the list is linear anyway, so finding the IDs is too.
+        # Delete from the end so that remaining IDs stay valid
+        zone_ids = sorted(
+            (zones_storage.index(zone) for zone in zones), reverse=True)
+
+        self.execute(('batch', tuple(
+            ('delete', zone_id, zones_storage[zone_id])
+            for zone_id in zone_ids
+        )))
+
+    def execute(self, operation):
+        self._apply(operation)
+        self._undo.append(operation)
+        self._redo.clear()
+
+    def undo(self):
+        if not self._undo:
+            raise JournalEmpty("Nothing to undo")
+
+        operation = self._undo.pop()
+        self._apply(invert_operation(operation))
+        self._redo.append(operation)
+        return operation
+
+    def redo(self):
+        if not self._redo:
+            raise JournalEmpty("Nothing to redo")
+
+        operation = self._redo.pop()
+        self._apply(operation)
+        self._undo.append(operation)
+        return operation
+
+    def reset(self, truncate_log):
+        self._undo.clear()
+        self._redo.clear()
+        self.restart_log(truncate_log)
+
+    def restart_log(self, truncate_log):
+        # Edits from now on are logged against the zones as they are now;
+        # the next one starts a new log over any existing one
+        self.close_log()
+        self._log_base = [zone_digest(zone) for zone in zones_storage]
+        self._log_started = False
+
+        if truncate_log and self.log_path.isfile():
+            self.log_path.remove()
+
+    def discard_stale_log(self):
+        # Keep the log only if it can be replayed onto the current zones,
+        # e.g. after the server crashed and came back on the same map
+        try:
+            base = self._read_log_base()
+        except EditLogError:
+            base = None
+
+        if base is None or sorted(base) != sorted(self._log_base):
+            if self.log_path.isfile():
+                self.log_path.remove()
+
+    def _apply(self, operation, log=True):
+        kind = operation[0]
+        if kind == 'add':
+            zones_storage.insert(operation[1], operation[2])
+            highlights.insert_zone(operation[1])
+        elif kind == 'delete':
+            highlights.pop_zone(operation[1])
+            zones_storage.pop(operation[1])
+        elif kind == 'set':
+            set_zone_value(operation[1], operation[2], operation[4])
         else:
-            teleport_origin = vector_to_str(zone.teleport['origin'])
+            for sub_operation in operation[1]:
+                self._apply(sub_operation, log=False)
+
+        if log and EDIT_LOG_ENABLED:
+            self._write_log(operation)
+
+    @property
+    def log_path(self):
+        return EDIT_LOGS_PATH / "{basename}.editlog".format(
+            basename=global_vars.map_name)
 
-        if zone.teleport['angles'] is None:
-            teleport_angles = "- - -"
+    def _write_log(self, operation):
+        if operation[0] == 'batch':
+            lines = [self._log_line(sub_operation)
+                     for sub_operation in operation[1]]
         else:
-            teleport_angles = vector_to_str(zone.teleport['angles'])
+            lines = [self._log_line(operation)]
 
-        if zone.boost is None:
-            boost = "- - -"
+        if self._log is None:
+            EDIT_LOGS_PATH.makedirs_p()
+            if self._log_started:
+                self._log = open(self.log_path, 'a')
+            else:
+                self._log = open(self.log_path, 'w')
+                lines.insert(0, json.dumps(
+                    ['base', self._log_base], separators=(',', ':')) + "\n")
+
+                self._log_started = True
+
+        self._log.write("".join(lines))
+        self._log.flush()
+
+    @staticmethod
+    def _log_line(operation):
+        kind = operation[0]
+        if kind == 'add':
+            entry = [kind, operation[1], operation[2].to_dict()]
+        elif kind == 'delete':
+            entry = [kind, operation[1]]
         else:
-            boost = vector_to_str(zone.boost)
+            # The log is opt-in, only pay for finding the ID when it's on
+            entry = [kind, zones_storage.index(operation[1]), operation[2],
+                     value_to_json(operation[2], operation[4])]
+
+        return json.dumps(entry, separators=(',', ':')) + "\n"
+
+    def close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _read_log_entries(self):
+        entries = []
+        with open(self.log_path, 'r') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # Line cut short by the crash
+                    break
+
+        if not entries or not isinstance(entries[0], list) or (
+                entries[0][:1] != ['base']):
+
+            raise EditLogError("the log has no base")
+
+        return entries
+
+    def _read_log_base(self):
+        if not self.log_path.isfile():
+            return None
+
+        return self._read_log_entries()[0][1]
 
-        popup.append(Text(strings['popup highlight current_zone'].tokenize(
+    def replay_log(self):
+        if not self.log_path.isfile():
+            return 0
+
+        entries = self._read_log_entries()
+
+        # Stored zones come back in the order of the log's base (the SQLite
+        # backend may return them in another order)
+        zones_by_digest = {}
+        for zone in zones_storage:
+            zones_by_digest.setdefault(zone_digest(zone), []).append(zone)
+
+        base = entries[0][1]
+        zones = []
+        for digest in base:
+            if not zones_by_digest.get(digest):
+                raise EditLogError(
+                    "the log was written for other zones than the saved ones")
+
+            zones.append(zones_by_digest[digest].pop())
+
+        if len(zones) != len(zones_storage):
+            raise EditLogError(
+                "the log was written for other zones than the saved ones")
+
+        # Check every entry before changing anything, against a copy of
+        # the zone list that follows the adds and deletes
+        operations = []
+        shadow = list(zones)
+        for line_number, entry in enumerate(entries[1:], 2):
+            where = "line {}".format(line_number)
+            try:
+                kind, zone_id = entry[:2]
+            except (TypeError, ValueError):
+                raise EditLogError("{}: invalid entry".format(where))
+
+            max_zone_id = len(shadow) if kind == 'add' else len(shadow) - 1
+            if (not isinstance(zone_id, int) or isinstance(zone_id, bool) or
+                    not 0 <= zone_id <= max_zone_id):
+
+                raise EditLogError("{}: invalid zone ID {!r}".format(
+                    where, zone_id))
+
+            try:
+                if kind == 'add' and len(entry) == 3:
+                    validate_zone(entry[2], where + ": zone")
+                    zone = Zone(entry[2])
+                    shadow.insert(zone_id, zone)
+                    operations.append((kind, zone_id, zone))
+                elif kind == 'delete' and len(entry) == 2:
+                    operations.append((kind, zone_id, shadow.pop(zone_id)))
+                elif kind == 'set' and len(entry) == 4:
+                    zone = shadow[zone_id]
+                    key = entry[2]
+                    check_zone_value(zone, key, entry[3], where + ": zone")
+                    operations.append((kind, zone, key, None,
+                                       value_from_json(key, entry[3])))
+                else:
+                    raise EditLogError("{}: invalid entry".format(where))
+            except ZoneDataError as e:
+                raise EditLogError(str(e))
+
+        zones_storage.reorder(zones)
+        for operation in operations:
+            self._apply(operation, log=False)
+
+        # Later edits carry on with the same log
+        self._log_base = base
+        self._log_started = True
+        return len(operations)
+
+journal = EditJournal()
+
+
+HIGHLIGHT_OPTION_NEXT = SimpleOption(
+    choice_index=1,
+    text=strings['popup highlight next_zone'],
+    value=HighlightChoice.HL_NEXT
+)
+HIGHLIGHT_OPTION_PREV = SimpleOption(
+    choice_index=2,
+    text=strings['popup highlight prev_zone'],
+    value=HighlightChoice.HL_PREV
+)
+HIGHLIGHT_OPTION_DELETE = SimpleOption(
+    choice_index=3,
+    text=strings['popup highlight delete'],
+    value=HighlightChoice.DELETE
+)
+HIGHLIGHT_OPTION_TOGGLE_NOJUMP = SimpleOption(
+    choice_index=4,
+    text=strings['popup highlight toggle_nojump'],
+    value=HighlightChoice.TOGGLE_NOJUMP
+)
+HIGHLIGHT_OPTION_TOGGLE_NODUCK = SimpleOption(
+    choice_index=5,
+    text=strings['popup highlight toggle_noduck'],
+    value=HighlightChoice.TOGGLE_NODUCK
+)
+HIGHLIGHT_MENU_CONTENT_NONE = (
+    HIGHLIGHT_OPTION_NEXT,
+    HIGHLIGHT_OPTION_PREV,
+    Text(strings['popup highlight current_zone none']),
+)
+
+
+def build_highlight_menu_content(zone):
+    if zone.teleport['origin'] is None:
+        teleport_origin = "- - -"
+    else:
+        teleport_origin = vector_to_str(zone.teleport['origin'])
+
+    if zone.teleport['angles'] is None:
+        teleport_angles = "- - -"
+    else:
+        teleport_angles = vector_to_str(zone.teleport['angles'])
+
+    if zone.boost is None:
+        boost = "- - -"
+    else:
+        boost = vector_to_str(zone.boost)
+
+    return (
+        HIGHLIGHT_OPTION_NEXT,
+        HIGHLIGHT_OPTION_PREV,
+        Text(strings['popup highlight current_zone'].tokenize(
             nojump=zone.nojump,
             noduck=zone.noduck,
             speed_cap=zone.speed_cap,
             teleport_origin=teleport_origin,
             teleport_angles=teleport_angles,
             boost=boost,
-        )))
+            filter=filter_to_str(zone.filter),
+        )),
+        HIGHLIGHT_OPTION_DELETE,
+        HIGHLIGHT_OPTION_TOGGLE_NOJUMP,
+        HIGHLIGHT_OPTION_TOGGLE_NODUCK,
+    )
 
-        popup.append(SimpleOption(
-            choice_index=3,
-            text=strings['popup highlight delete'],
-            value=HighlightChoice.DELETE
-        ))
 
-        popup.append(SimpleOption(
-            choice_index=4,
-            text=strings['popup highlight toggle_nojump'],
-            value=HighlightChoice.TOGGLE_NOJUMP
-        ))
+def send_highlight_popup(index, zone):
+    if index in popups:
+        popups[index].close(index)
 
-        popup.append(SimpleOption(
-            choice_index=5,
-            text=strings['popup highlight toggle_noduck'],
-            value=HighlightChoice.TOGGLE_NODUCK
-        ))
+    try:
+        popup = highlight_popups[index]
+    except KeyError:
+        popup = highlight_popups[index] = SimpleMenu(
+            select_callback=select_callback_highlight)
 
+    if zone is None:
+        popup[:] = HIGHLIGHT_MENU_CONTENT_NONE
+    else:
+        popup[:] = zone.menu_content
+
+    popups[index] = popup
     popup.send(index)
+    start_drawing()
 
 
 def send_delete_popup(index):
     if index in popups:
         popups[index].close(index)
 
-    popup = popups[index] = SimpleMenu(select_callback=select_callback_delete)
-    popup.append(Text(strings['popup delete title']))
-    popup.append(SimpleOption(
-        choice_index=1,
-        text=strings['popup delete no'],
-        value=False
-    ))
-    popup.append(SimpleOption(
-        choice_index=2,
-        text=strings['popup delete yes'],
-        value=True
-    ))
+    popup = popups[index] = delete_popup
     popup.send(index)
 
 
@@ -496,13 +1164,15 @@ def select_callback_highlight(popup, index, option):
     elif option.value == HighlightChoice.DELETE:
         send_delete_popup(index)
     elif option.value == HighlightChoice.TOGGLE_NOJUMP:
-        zone = zones_storage[highlights.get_zone_id_by_index(index)]
-        zone.nojump = not zone.nojump
-        send_highlight_popup(index, zone)
+        zone_id = highlights.get_zone_id_by_index(index)
+        journal.set_value(
+            zone_id, 'nojump', not zones_storage[zone_id].nojump)
+        send_highlight_popup(index, zones_storage[zone_id])
     elif option.value == HighlightChoice.TOGGLE_NODUCK:
-        zone = zones_storage[highlights.get_zone_id_by_index(index)]
-        zone.noduck = not zone.noduck
-        send_highlight_popup(index, zone)
+        zone_id = highlights.get_zone_id_by_index(index)
+        journal.set_value(
+            zone_id, 'noduck', not zones_storage[zone_id].noduck)
+        send_highlight_popup(index, zones_storage[zone_id])
 
 
 def select_callback_delete(popup, index, option):
@@ -512,9 +1182,7 @@ def select_callback_delete(popup, index, option):
 
     if option.value:
         zone = highlights.highlight_prev(index)
-
-        highlights.pop_zone(old_zone_id)
-        zones_storage.pop(old_zone_id)
+        journal.delete_zone(old_zone_id)
 
     else:
         zone = zones_storage[old_zone_id]
@@ -522,14 +1190,29 @@ def select_callback_delete(popup, index, option):
     send_highlight_popup(index, zone)
 
 
+delete_popup = SimpleMenu(
+    [
+        Text(strings['popup delete title']),
+        SimpleOption(
+            choice_index=1,
+            text=strings['popup delete no'],
+            value=False
+        ),
+        SimpleOption(
+            choice_index=2,
+            text=strings['popup delete yes'],
+            value=True
+        ),
+    ],
+    select_callback=select_callback_delete
+)
+
+
 @TypedClientCommand('lz_start', "limit_zones_editor.create")
 @TypedSayCommand('!lz_start', "limit_zones_editor.create")
 def typed_lz_start(command_info, attach_to_str:str="view"):
-    if attach_to_str == "view":
-        attach_to = VectorAttachTo.VIEW_COORDINATES
-    elif attach_to_str == "origin":
-        attach_to = VectorAttachTo.PLAYER_ORIGIN
-    else:
+    attach_to = ATTACH_TO_ARGS.get(attach_to_str)
+    if attach_to is None:
         MSG_ERR_INVALID_ATTACH_TO_ARG.send(command_info.index)
         return
 
@@ -552,6 +1235,120 @@ def typed_lz_start(command_info):
         MSG_ERR_INVALID_COORDINATES.send(command_info.index)
 
 
+@TypedClientCommand('lz_select', "limit_zones_editor.create")
+@TypedSayCommand('!lz_select', "limit_zones_editor.create")
+def typed_lz_select(command_info):
+    try:
+        mins, maxs = zones_edit.finish_box(command_info.index)
+    except IncorrectEditOrder:
+        MSG_LZ_END_WRONG_ORDER.send(command_info.index)
+        return
+    except InvalidCoordinates:
+        MSG_ERR_INVALID_COORDINATES.send(command_info.index)
+        return
+
+    zones = zones_storage.query_box(mins, maxs)
+    selections.select(command_info.index, zones)
+    MSG_LZ_SELECT_DONE.send(command_info.index, zones=len(zones))
+    start_drawing()
+
+
+@TypedClientCommand('lz_select_radius', "limit_zones_editor.create")
+@TypedSayCommand('!lz_select_radius', "limit_zones_editor.create")
+def typed_lz_select_radius(
+        command_info, radius:float, attach_to_str:str="origin"):
+
+    attach_to = ATTACH_TO_ARGS.get(attach_to_str)
+    if attach_to is None:
+        MSG_ERR_INVALID_ATTACH_TO_ARG.send(command_info.index)
+        return
+
+    if attach_to == VectorAttachTo.VIEW_COORDINATES:
+        center = players[command_info.index].view_coordinates
+    else:
+        center = players[command_info.index].origin
+
+    if center is None:
+        MSG_ERR_INVALID_COORDINATES.send(command_info.index)
+        return
+
+    zones = zones_storage.query_radius(center, radius)
+    selections.select(command_info.index, zones)
+    MSG_LZ_SELECT_DONE.send(command_info.index, zones=len(zones))
+    start_drawing()
+
+
+@TypedClientCommand('lz_select_clear', "limit_zones_editor.create")
+@TypedSayCommand('!lz_select_clear', "limit_zones_editor.create")
+def typed_lz_select_clear(command_info):
+    selections.select(command_info.index, ())
+    MSG_LZ_SELECT_DONE.send(command_info.index, zones=0)
+
+
+def parse_bool(value_str):
+    if value_str in ("1", "on", "yes", "true"):
+        return True
+
+    if value_str in ("0", "off", "no", "false"):
+        return False
+
+    raise ValueError("Expected a boolean, got '{}'".format(value_str))
+
+
+def parse_speed_cap(value_str):
+    if value_str == "none":
+        return None
+
+    return float(value_str)
+
+
+BULK_VALUE_PARSERS = {
+    'nojump': parse_bool,
+    'noduck': parse_bool,
+    'speed_cap': parse_speed_cap,
+}
+
+
+@TypedClientCommand('lz_bulk_set', "limit_zones_editor.create")
+@TypedSayCommand('!lz_bulk_set', "limit_zones_editor.create")
+def typed_lz_bulk_set(command_info, key:str, value_str:str):
+    parser = BULK_VALUE_PARSERS.get(key)
+    if parser is None:
+        MSG_ERR_INVALID_BULK_KEY.send(command_info.index)
+        return
+
+    try:
+        value = parser(value_str.lower())
+    except ValueError:
+        MSG_ERR_INVALID_BULK_VALUE.send(command_info.index)
+        return
+
+    zones = selections.get(command_info.index)
+    if not zones:
+        MSG_ERR_NONE_SELECTED.send(command_info.index)
+        return
+
+    # All zones change in one journal operation, so one lz_undo reverts it
+    journal.set_values(zones, key, value)
+    MSG_LZ_BULK_DONE.send(command_info.index, zones=len(zones))
+    refresh_highlight_popup(command_info.index)
+
+
+@TypedClientCommand('lz_bulk_delete', "limit_zones_editor.create")
+@TypedSayCommand('!lz_bulk_delete', "limit_zones_editor.create")
+def typed_lz_bulk_delete(command_info):
+    zones = selections.get(command_info.index)
+    if not zones:
+        MSG_ERR_NONE_SELECTED.send(command_info.index)
+        return
+
+    # Deleting the zones also empties the selection
+    zone_count = len(zones)
+    journal.delete_zones(tuple(zones))
+    MSG_LZ_BULK_DONE.send(command_info.index, zones=zone_count)
+    refresh_highlight_popup(command_info.index)
+
+
 @TypedClientCommand('lz_cancel', "limit_zones_editor.create")
 @TypedSayCommand('!lz_cancel', "limit_zones_editor.create")
 def typed_lz_cancel(command_info):
@@ -564,13 +1361,93 @@ def typed_lz_cancel(command_info):
 @TypedClientCommand('lz_save_to_file', "limit_zones_editor.create")
 @TypedSayCommand('!lz_save_to_file', "limit_zones_editor.create")
 def typed_lz_save_to_file(command_info):
-    zones_storage.save_to_file()
+    zones_storage.save_zones()
+
+    # The log only has to cover what isn't saved; undo and redo still work
+    # as the operations hold the zones themselves
+    journal.restart_log(truncate_log=True)
 
 
 @TypedClientCommand('lz_load_from_file', "limit_zones_editor.create")
 @TypedSayCommand('!lz_load_from_file', "limit_zones_editor.create")
 def typed_lz_load_from_file(command_info):
-    zones_storage.load_from_file()
+    try:
+        zones_storage.load_zones()
+    except ZoneDataError as e:
+        MSG_ERR_INVALID_ZONES.send(command_info.index, error=str(e))
+        return
+
+    journal.reset(truncate_log=True)
+
+
+@TypedClientCommand('lz_recover', "limit_zones_editor.create")
+@TypedSayCommand('!lz_recover', "limit_zones_editor.create")
+def typed_lz_recover(command_info):
+    try:
+        zones_storage.load_zones()
+    except ZoneDataError as e:
+        MSG_ERR_INVALID_ZONES.send(command_info.index, error=str(e))
+        return
+
+    journal.reset(truncate_log=False)
+
+    try:
+        operations = journal.replay_log()
+    except EditLogError as e:
+        MSG_ERR_INVALID_EDIT_LOG.send(command_info.index, error=str(e))
+        return
+
+    MSG_LZ_RECOVER_DONE.send(command_info.index, operations=operations)
+
+
+def refresh_highlight_popup(index):
+    zone_id = highlights.get_zone_id_by_index(index)
+    if zone_id is None:
+        send_highlight_popup(index, None)
+    else:
+        send_highlight_popup(index, zones_storage[zone_id])
+
+
+@TypedClientCommand('lz_undo', "limit_zones_editor.create")
+@TypedSayCommand('!lz_undo', "limit_zones_editor.create")
+def typed_lz_undo(command_info):
+    try:
+        journal.undo()
+    except JournalEmpty:
+        MSG_LZ_UNDO_EMPTY.send(command_info.index)
+        return
+
+    refresh_highlight_popup(command_info.index)
+
+
+@TypedClientCommand('lz_redo', "limit_zones_editor.create")
+@TypedSayCommand('!lz_redo', "limit_zones_editor.create")
+def typed_lz_redo(command_info):
+    try:
+        journal.redo()
+    except JournalEmpty:
+        MSG_LZ_REDO_EMPTY.send(command_info.index)
+        return
+
+    refresh_highlight_popup(command_info.index)
+
+
+@TypedClientCommand('lz_export_json', "limit_zones_editor.create")
+@TypedSayCommand('!lz_export_json', "limit_zones_editor.create")
+def typed_lz_export_json(command_info):
+    zones_storage.save_zones(JSONBackend(MAPDATA_PATH))
+
+
+@TypedClientCommand('lz_import_json', "limit_zones_editor.create")
+@TypedSayCommand('!lz_import_json', "limit_zones_editor.create")
+def typed_lz_import_json(command_info):
+    try:
+        zones_storage.load_zones(JSONBackend(MAPDATA_PATH))
+    except ZoneDataError as e:
+        MSG_ERR_INVALID_ZONES.send(command_info.index, error=str(e))
+        return
+
+    journal.reset(truncate_log=True)
 
 
 @TypedClientCommand('lz_inspect', "limit_zones_editor.inspect")
@@ -582,6 +1459,7 @@ def typed_lz_inspect(command_info):
     else:
         inspects.add_recipient(command_info.index)
         MSG_LZ_INSPECT_START.send(command_info.index)
+        start_drawing()
 
 
 @TypedClientCommand('lz_highlight', "limit_zones_editor.create")
@@ -603,9 +1481,8 @@ def typed_lz_set_teleport_origin(command_info, x:float, y:float, z:float):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.teleport['origin'] = Vector(x, y, z)
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(zone_id, 'teleport_origin', Vector(x, y, z))
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_copy_teleport_origin', "limit_zones_editor.create")
@@ -616,9 +1493,9 @@ def typed_lz_copy_teleport_origin(command_info):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.teleport['origin'] = players[command_info.index].origin
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(
+        zone_id, 'teleport_origin', players[command_info.index].origin)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_unset_teleport_origin', "limit_zones_editor.create")
@@ -629,9 +1506,8 @@ def typed_lz_unset_teleport_origin(command_info):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.teleport['origin'] = None
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(zone_id, 'teleport_origin', None)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_set_teleport_angles', "limit_zones_editor.create")
@@ -642,9 +1518,8 @@ def typed_lz_set_teleport_angles(command_info, x:float, y:float, z:float):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.teleport['angles'] = Vector(x, y, z)
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(zone_id, 'teleport_angles', Vector(x, y, z))
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_copy_teleport_angles', "limit_zones_editor.create")
@@ -655,9 +1530,9 @@ def typed_lz_copy_teleport_angles(command_info):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.teleport['angles'] = players[command_info.index].angles
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(
+        zone_id, 'teleport_angles', players[command_info.index].angles)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_unset_teleport_angles', "limit_zones_editor.create")
@@ -668,9 +1543,8 @@ def typed_lz_unset_teleport_angles(command_info):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.teleport['angles'] = None
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(zone_id, 'teleport_angles', None)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_set_speed_cap', "limit_zones_editor.create")
@@ -681,9 +1555,8 @@ def typed_lz_set_speed_cap(command_info, speed_cap:float):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.speed_cap = speed_cap
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(zone_id, 'speed_cap', speed_cap)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_unset_speed_cap', "limit_zones_editor.create")
@@ -694,9 +1567,8 @@ def typed_lz_unset_speed_cap(command_info):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.speed_cap = None
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(zone_id, 'speed_cap', None)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_set_boost', "limit_zones_editor.create")
@@ -707,9 +1579,8 @@ def typed_lz_set_boost(command_info, x:float, y:float, z:float):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
-    zone = zones_storage[zone_id]
-    zone.boost = Vector(x, y, z)
-    send_highlight_popup(command_info.index, zone)
+    journal.set_value(zone_id, 'boost', Vector(x, y, z))
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
 
 
 @TypedClientCommand('lz_unset_boost', "limit_zones_editor.create")
@@ -720,30 +1591,168 @@ def typed_lz_unset_boost(command_info):
         MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
         return
 
+    journal.set_value(zone_id, 'boost', None)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
+
+
+def make_filter(teams, flags):
+    # A filter without teams and flags would match no player at all; clearing
+    # the last of them removes the filter instead
+    if not teams and not flags:
+        return None
+
+    return {'teams': sorted(set(teams)), 'flags': sorted(set(flags))}
+
+
+@TypedClientCommand('lz_set_filter_teams', "limit_zones_editor.create")
+@TypedSayCommand('!lz_set_filter_teams', "limit_zones_editor.create")
+def typed_lz_set_filter_teams(command_info, *teams:int):
+    zone_id = highlights.get_zone_id_by_index(command_info.index)
+    if zone_id is None:
+        MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
+        return
+
+    if not all(0 <= team < TEAM_COUNT for team in teams):
+        MSG_ERR_INVALID_TEAM.send(command_info.index)
+        return
+
+    zone = zones_storage[zone_id]
+    flags = zone.filter['flags'] if zone.filter is not None else []
+    journal.set_value(zone_id, 'filter', make_filter(teams, flags))
+    send_highlight_popup(command_info.index, zone)
+
+
+@TypedClientCommand('lz_set_filter_flags', "limit_zones_editor.create")
+@TypedSayCommand('!lz_set_filter_flags', "limit_zones_editor.create")
+def typed_lz_set_filter_flags(command_info, *flags:str):
+    zone_id = highlights.get_zone_id_by_index(command_info.index)
+    if zone_id is None:
+        MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
+        return
+
     zone = zones_storage[zone_id]
-    zone.boost = None
+    teams = zone.filter['teams'] if zone.filter is not None else []
+    journal.set_value(zone_id, 'filter', make_filter(teams, flags))
     send_highlight_popup(command_info.index, zone)
 
 
+@TypedClientCommand('lz_unset_filter', "limit_zones_editor.create")
+@TypedSayCommand('!lz_unset_filter', "limit_zones_editor.create")
+def typed_lz_unset_filter(command_info):
+    zone_id = highlights.get_zone_id_by_index(command_info.index)
+    if zone_id is None:
+        MSG_ERR_NONE_HIGHLIGHTED.send(command_info.index)
+        return
+
+    journal.set_value(zone_id, 'filter', None)
+    send_highlight_popup(command_info.index, zones_storage[zone_id])
+
+
 @OnClientDisconnect
 def listener_on_client_disconnect(index):
-    zones_edit.pop(index, None)
+    zones_edit.client_disconnect(index)
     inspects.client_disconnect(index)
     highlights.client_disconnect(index)
+    selections.client_disconnect(index)
 
     popups.pop(index, None)
+    highlight_popups.pop(index, None)
+
+
+render_frame = 0
+
+
+def get_governor():
+    # The governor belongs to the LimitZones plugin, which has to be loaded
+    # for the editor to back off under gameplay load. Source.Python drops
+    # every limit_zones.* module when that plugin is unloaded or reloaded,
+    # so look the current instance up on every use instead of keeping the
+    # one from import time. Without LimitZones there's nothing to protect,
+    # and the editor draws at full rate
+    module = sys.modules.get('limit_zones.governor')
+    if module is None:
+        return None
+
+    return module.governor
 
 
 @TickRepeat
 def tick_repeat():
+    global render_frame
+
+    # Nothing left to draw, sleep until the next editor command
+    if not (zones_edit or len(inspects) or highlights.is_active() or
+            selections):
+
+        tick_repeat.stop()
+        return
+
+    # When LimitZones is over its tick budget, draw less often and keep the
+    # beams alive until the next frame that is drawn
+    governor = get_governor()
+    if governor is None:
+        render_throttle = 1
+    else:
+        render_frame += 1
+        if not governor.should_run_frame('editor_render', render_frame):
+            return
+
+        render_throttle = governor.render_throttle
+
+    start = perf_counter()
+
     zones_edit.tick()
     inspects.tick()
     highlights.tick()
+    selections.tick()
+    renderer.flush(TICK_REPEAT_INTERVAL * render_throttle)
+
+    if governor is not None:
+        governor.charge(global_vars.tick_count, perf_counter() - start)
 
-tick_repeat.start(TICK_REPEAT_INTERVAL, limit=0)
+
+@TypedClientCommand('lz_render_stats', "limit_zones_editor.create")
+@TypedSayCommand('!lz_render_stats', "limit_zones_editor.create")
+def typed_lz_render_stats(command_info):
+    edges, beams = renderer.last_stats
+    MSG_LZ_RENDER_STATS.send(command_info.index, edges=edges, beams=beams)
+
+
+def start_drawing():
+    if tick_repeat.status != TickRepeatStatus.RUNNING:
+        tick_repeat.start(TICK_REPEAT_INTERVAL, limit=0)
+
+
+def load():
+    echo_console(
+        "{name}: loaded in {time:.1f} ms (strings {strings:.1f} ms)".format(
+            name=info.name,
+            time=(perf_counter() - init_start) * 1000,
+            strings=strings_time * 1000
+        )
+    )
+
+
+def unload():
+    tick_repeat.stop()
+    journal.close_log()
+    zones_backend.close()
 
 
 @OnLevelInit
 def listener_on_level_init(level_name):
+    # The previous map's zones mustn't be edited (and logged, and saved)
+    # as this map's
+    try:
+        zones_storage.load_zones()
+    except ZoneDataError as e:
+        zones_storage.unload_zones()
+        echo_console("{name}: zones of {map_name} weren't loaded: {error}"
+                     "".format(name=info.name, map_name=level_name, error=e))
+
+    journal.reset(truncate_log=False)
+    journal.discard_stale_log()
+    selections.clear()
     popups.clear()
+    highlight_popups.clear()
     players.clear()
@@ -0,0 +1,592 @@
+"""Differential check of LimitZones zone logic against the reference model.
+
+Generates random zone layouts, zone filters and player movement (including
+teleports, deaths and round restarts), turns them into the touch and
+run-command events the engine would fire and feeds the same events to the
+reference model and to every backend. The expected output is worked out
+independently of the plugin: the reference model only sees the touches whose
+filter matches the player, and with --swept, zones crossed between two
+commands are found by brute force and applied for that one command. Button
+masks and teleports have to match exactly, velocity corrections up to
+rounding; the speedup of each backend over the reference is reported.
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+from math import isclose
+from pathlib import Path
+from random import Random
+import sys
+from time import perf_counter
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH / "addons" / "source-python" / "plugins"))
+
+from limit_zones import zone_logic
+from limit_zones.reference import ReferenceZoneLogic
+from limit_zones.restrictions import IN_DUCK, IN_JUMP, PlayerRestrictions
+from limit_zones.spatial import GridIndex
+from limit_zones.zone_data import normalised_box, ZoneData
+from limit_zones.zone_filters import (
+    build_filter_mask, flag_bit, PLAYER_BIT, TEAM_COUNT, team_bit)
+
+
+EVENT_START_TOUCH = 0
+EVENT_END_TOUCH = 1
+EVENT_RUN_COMMAND = 2
+
+# Maps are much wider than they are high
+WORLD_SIZE = 2048
+WORLD_HEIGHT = 256
+SPEED_CAPS = (100.0, 150.0, 200.0, 250.0)
+FLAGS = ('vip', 'bot')
+
+# Other buttons are passed through untouched, but must stay untouched
+IN_ATTACK = 1 << 0
+IN_FORWARD = 1 << 3
+BUTTONS = (IN_ATTACK, IN_JUMP, IN_DUCK, IN_FORWARD)
+
+# Same values as in limit_zones.py
+SWEPT_CELL_SIZE = 512
+SWEPT_MAX_DISTANCE = 256
+PLAYER_HULL_MINS = (-16, -16, 0)
+PLAYER_HULL_MAXS = (16, 16, 72)
+
+# Trigger entities are numbered after the player slots
+FIRST_ENTITY_INDEX = 65
+
+
+class PluginZoneLogic:
+    """limit_zones.zone_logic, called the way the touch hooks and the
+    run-command listener of limit_zones.py call it."""
+    def __init__(self, zones, player_masks, swept):
+        self.restrictions = defaultdict(PlayerRestrictions)
+        self.touched_zone_entities = defaultdict(list)
+        self.player_masks = player_masks
+        self.filter_masks = [build_filter_mask(zone.filter) for zone in zones]
+
+        self.swept_index = None
+        if swept:
+            self.swept_index = GridIndex(SWEPT_CELL_SIZE)
+            for zone in zones:
+                zone_logic.insert_swept_zone(
+                    self.swept_index, zone, self.filter_masks[zone.id],
+                    PLAYER_HULL_MINS, PLAYER_HULL_MAXS)
+
+    def start_touch(self, index, entity_index, zone):
+        return zone_logic.start_touch(
+            self.restrictions[index], self.touched_zone_entities[index],
+            entity_index, zone, self.filter_masks[zone.id],
+            self.player_masks[index])
+
+    def end_touch(self, index, entity_index, zone):
+        zone_logic.end_touch(
+            self.restrictions[index], self.touched_zone_entities[index],
+            entity_index, zone)
+
+    def run_command(self, index, buttons, velocity, start, end):
+        player_restrictions = self.restrictions[index]
+
+        crossed_zones = []
+        if self.swept_index is not None and start is not None:
+            crossed_zones = zone_logic.find_crossed_zones(
+                self.swept_index, start, end, self.player_masks[index],
+                SWEPT_MAX_DISTANCE)
+
+        crossed = tuple(
+            (zone.id, zone_logic.enter_zone(player_restrictions, zone))
+            for zone in crossed_zones)
+
+        buttons, speed_cap = zone_logic.run_command(
+            player_restrictions, buttons)
+
+        base_velocity = None
+        if speed_cap is not None:
+            base_velocity = zone_logic.correct_velocity(velocity, speed_cap)
+
+        for zone in crossed_zones:
+            zone_logic.leave_zone(player_restrictions, zone)
+
+        return crossed, buttons, base_velocity
+
+
+BACKENDS = {
+    'plugin': PluginZoneLogic,
+}
+
+
+def random_vector(rng, size, height=None):
+    height = size if height is None else height
+    return {
+        'x': rng.uniform(-size, size),
+        'y': rng.uniform(-size, size),
+        'z': rng.uniform(-height, height),
+    }
+
+
+def random_origin(rng):
+    return (rng.uniform(-WORLD_SIZE, WORLD_SIZE),
+            rng.uniform(-WORLD_SIZE, WORLD_SIZE),
+            rng.uniform(-WORLD_HEIGHT, WORLD_HEIGHT))
+
+
+def random_filter(rng):
+    teams = [team for team in range(TEAM_COUNT) if rng.random() < 0.3]
+    flags = [flag for flag in FLAGS if rng.random() < 0.3]
+    return {'teams': teams, 'flags': flags}
+
+
+def random_zones(rng, count, teleport_chance, filter_chance):
+    zones = []
+    for zone_id in range(count):
+        corner = random_vector(rng, WORLD_SIZE, WORLD_HEIGHT)
+        size = rng.choice((64, 256, 1024))
+
+        # Corners are stored in either order, like the editor saves them
+        other = {key: value + rng.uniform(-size, size)
+                 for key, value in corner.items()}
+
+        teleport = {'origin': None, 'angles': None}
+        if rng.random() < teleport_chance:
+            teleport['origin'] = random_vector(rng, WORLD_SIZE, WORLD_HEIGHT)
+            if rng.random() < 0.5:
+                teleport['angles'] = {'x': 0, 'y': rng.uniform(-180, 180),
+                                      'z': 0}
+
+        zones.append(ZoneData({
+            'mins': corner,
+            'maxs': other,
+            'properties': {
+                'nojump': rng.random() < 0.3,
+                'noduck': rng.random() < 0.3,
+                'speed_cap': (rng.choice(SPEED_CAPS)
+                              if rng.random() < 0.5 else None),
+                'teleport': teleport,
+                'boost': (random_vector(rng, 300)
+                          if rng.random() < 0.05 else None),
+                'filter': (random_filter(rng)
+                           if rng.random() < filter_chance else None),
+            },
+        }, zone_id))
+
+    return zones
+
+
+class Player:
+    def __init__(self, index, team, flags):
+        self.index = index
+        self.team = team
+        self.flags = flags
+        self.origin = None
+        self.previous_origin = None
+        self.velocity = (0.0, 0.0, 0.0)
+        self.alive = False
+        self.respawn_tick = 0
+        self.touching = set()
+
+    @property
+    def mask(self):
+        mask = PLAYER_BIT | team_bit(self.team)
+        for flag in self.flags:
+            mask |= flag_bit(flag)
+
+        return mask
+
+
+def random_players(rng, count):
+    return [
+        Player(index, rng.randrange(TEAM_COUNT),
+               [flag for flag in FLAGS if rng.random() < 0.2])
+        for index in range(1, count + 1)
+    ]
+
+
+def filter_matches(zone, player):
+    if zone.filter is None:
+        return True
+
+    return (player.team in zone.filter['teams'] or
+            any(flag in zone.filter['flags'] for flag in player.flags))
+
+
+def touched_box(zone):
+    # The box the player's origin is in while its hull touches the zone
+    mins, maxs = normalised_box(zone.mins, zone.maxs)
+    return (
+        tuple(mins[axis] - PLAYER_HULL_MAXS[axis] for axis in range(3)),
+        tuple(maxs[axis] - PLAYER_HULL_MINS[axis] for axis in range(3)),
+    )
+
+
+def inside(point, box):
+    mins, maxs = box
+    return (mins[0] <= point[0] <= maxs[0] and
+            mins[1] <= point[1] <= maxs[1] and
+            mins[2] <= point[2] <= maxs[2])
+
+
+def passes_through(start, end, box):
+    # Intersection of the parameter ranges in which each coordinate of the
+    # segment lies within the box
+    mins, maxs = box
+    low, high = 0.0, 1.0
+    for axis in range(3):
+        delta = end[axis] - start[axis]
+        if delta == 0:
+            if not mins[axis] <= start[axis] <= maxs[axis]:
+                return False
+
+            continue
+
+        first = (mins[axis] - start[axis]) / delta
+        second = (maxs[axis] - start[axis]) / delta
+        low = max(low, min(first, second))
+        high = min(high, max(first, second))
+
+    return low <= high
+
+
+def crossed_zone_ids(zones, boxes, player, start, end):
+    distance_sqr = sum((end[axis] - start[axis]) ** 2 for axis in range(3))
+    if not 0 < distance_sqr <= SWEPT_MAX_DISTANCE ** 2:
+        return ()
+
+    return tuple(
+        zone.id for zone, box in zip(zones, boxes)
+        if filter_matches(zone, player) and
+        not inside(start, box) and not inside(end, box) and
+        passes_through(start, end, box))
+
+
+class ReferenceReplay:
+    """ReferenceZoneLogic fed with what the simulation decided: only the
+    touches of zones whose filter matches the player, and the crossed zones
+    entered for the command they were crossed on."""
+    def __init__(self):
+        self.reference = ReferenceZoneLogic()
+
+    def start_touch(self, index, zone, matches):
+        if not matches:
+            return None
+
+        return self.reference.start_touch(index, zone)
+
+    def end_touch(self, index, zone, matches):
+        if matches:
+            self.reference.end_touch(index, zone)
+
+    def run_command(self, index, buttons, velocity, crossed_zones):
+        reference = self.reference
+        crossed = tuple(
+            (zone.id, reference.start_touch(index, zone))
+            for zone in crossed_zones)
+
+        buttons, base_velocity = reference.run_command(
+            index, buttons, velocity)
+
+        for zone in crossed_zones:
+            reference.end_touch(index, zone)
+
+        return crossed, buttons, base_velocity
+
+
+def simulate(rng, zones, players, ticks, swept,
+             death_chance, respawn_delay, round_restart_chance):
+    """Runs the world and returns the event stream together with the
+    expected output for every event.
+
+    Events carry what both sides need: the trigger's entity index and the
+    movement since the previous command for the plugin, whether the filter
+    matches and which zones were crossed for the reference.
+    """
+    boxes = [touched_box(zone) for zone in zones]
+    replay = ReferenceReplay()
+    entity_offset = FIRST_ENTITY_INDEX
+    events = []
+    outputs = []
+
+    def respawn(player):
+        player.alive = True
+        player.previous_origin = None
+        player.origin = random_origin(rng)
+        player.velocity = (0.0, 0.0, 0.0)
+
+    def emit(event, output):
+        events.append(event)
+        outputs.append(output)
+
+    def apply_actions(player, actions):
+        for action in actions:
+            if action[0] == 'teleport':
+                if action[1] is not None:
+                    player.origin = action[1]
+                    player.previous_origin = None
+            else:
+                player.velocity = action[1]
+
+    def end_touch(player, zone_id):
+        matches = filter_matches(zones[zone_id], player)
+        replay.end_touch(player.index, zones[zone_id], matches)
+        emit((EVENT_END_TOUCH, player.index, entity_offset + zone_id,
+              zone_id, matches), None)
+
+    for tick in range(ticks):
+        # Triggers are removed and recreated (with new entity indexes)
+        # without their end_touch being called, so whatever the players
+        # were touching stays applied
+        if rng.random() < round_restart_chance:
+            entity_offset += len(zones)
+            for player in players:
+                player.touching.clear()
+                respawn(player)
+
+        for player in players:
+            if not player.alive:
+                if tick >= player.respawn_tick:
+                    respawn(player)
+                else:
+                    continue
+
+            # Dying makes the player non-solid, which ends all touches
+            if rng.random() < death_chance:
+                for zone_id in sorted(player.touching):
+                    end_touch(player, zone_id)
+
+                player.touching.clear()
+                player.alive = False
+                player.respawn_tick = tick + respawn_delay
+                continue
+
+            # Random walk, with the occasional dash (fast enough to pass
+            # through zones between two commands) or jump across the map
+            chance = rng.random()
+            if chance < 0.01:
+                player.origin = random_origin(rng)
+            elif chance < 0.1:
+                player.origin = tuple(
+                    origin + rng.uniform(-150, 150)
+                    for origin in player.origin)
+            else:
+                player.velocity = tuple(
+                    axis + rng.uniform(-40, 40) for axis in player.velocity)
+                player.origin = tuple(
+                    origin + velocity / 64 for origin, velocity in zip(
+                        player.origin, player.velocity))
+
+            touching = {
+                zone_id for zone_id, box in enumerate(boxes)
+                if inside(player.origin, box)
+            }
+
+            for zone_id in sorted(player.touching - touching):
+                end_touch(player, zone_id)
+
+            for zone_id in sorted(touching - player.touching):
+                matches = filter_matches(zones[zone_id], player)
+                actions = replay.start_touch(
+                    player.index, zones[zone_id], matches)
+
+                emit((EVENT_START_TOUCH, player.index,
+                      entity_offset + zone_id, zone_id, matches), actions)
+
+                if actions is not None:
+                    apply_actions(player, actions)
+
+            # A teleported player is only untouched on the next tick
+            player.touching = touching
+
+            buttons = 0
+            for button in BUTTONS:
+                if rng.random() < 0.3:
+                    buttons |= button
+
+            start = player.previous_origin if swept else None
+            end = player.origin
+            player.previous_origin = end
+
+            crossed = ()
+            if start is not None:
+                crossed = crossed_zone_ids(zones, boxes, player, start, end)
+
+            output = replay.run_command(
+                player.index, buttons, player.velocity,
+                [zones[zone_id] for zone_id in crossed])
+
+            emit((EVENT_RUN_COMMAND, player.index, buttons, player.velocity,
+                  start, end, crossed), output)
+
+            for zone_id, actions in output[0]:
+                apply_actions(player, actions)
+
+            if output[2] is not None:
+                player.velocity = tuple(
+                    velocity + base for velocity, base in zip(
+                        player.velocity, output[2]))
+
+    return events, outputs
+
+
+def run_reference_events(replay, events, zones):
+    outputs = []
+    append = outputs.append
+    start_touch = replay.start_touch
+    end_touch = replay.end_touch
+    run_command = replay.run_command
+
+    for event in events:
+        event_type = event[0]
+        if event_type == EVENT_RUN_COMMAND:
+            append(run_command(event[1], event[2], event[3],
+                               [zones[zone_id] for zone_id in event[6]]))
+        elif event_type == EVENT_START_TOUCH:
+            append(start_touch(event[1], zones[event[3]], event[4]))
+        else:
+            end_touch(event[1], zones[event[3]], event[4])
+            append(None)
+
+    return outputs
+
+
+def run_events(logic, events, zones):
+    outputs = []
+    append = outputs.append
+    start_touch = logic.start_touch
+    end_touch = logic.end_touch
+    run_command = logic.run_command
+
+    for event in events:
+        event_type = event[0]
+        if event_type == EVENT_RUN_COMMAND:
+            append(run_command(
+                event[1], event[2], event[3], event[4], event[5]))
+        elif event_type == EVENT_START_TOUCH:
+            append(start_touch(event[1], event[2], zones[event[3]]))
+        else:
+            end_touch(event[1], event[2], zones[event[3]])
+            append(None)
+
+    return outputs
+
+
+def outputs_match(output, expected):
+    # Velocity corrections are computed differently (scale once, or
+    # normalise and then scale), so they may differ in the last bits
+    if isinstance(expected, float):
+        return isinstance(output, (int, float)) and isclose(
+            output, expected, rel_tol=1e-9, abs_tol=1e-9)
+
+    if isinstance(expected, (list, tuple)):
+        return (isinstance(output, (list, tuple)) and
+                len(output) == len(expected) and
+                all(outputs_match(item, expected_item)
+                    for item, expected_item in zip(output, expected)))
+
+    return output == expected
+
+
+def best_time(run, repeat):
+    best = None
+    outputs = None
+    for i in range(repeat):
+        start = perf_counter()
+        outputs = run()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return outputs, best
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--runs', type=int, default=20,
+        help="Number of random scenarios, each with its own zone layout")
+    parser.add_argument('--zones', type=int, default=200)
+    parser.add_argument('--players', type=int, default=32)
+    parser.add_argument('--ticks', type=int, default=1000)
+    parser.add_argument('--teleport-chance', type=float, default=0.1)
+    parser.add_argument('--filter-chance', type=float, default=0.5)
+    parser.add_argument('--death-chance', type=float, default=0.002)
+    parser.add_argument('--respawn-delay', type=int, default=64)
+    parser.add_argument('--round-restart-chance', type=float, default=0.001)
+    parser.add_argument(
+        '--swept', action='store_true',
+        help="Check with SWEPT_DETECTION enabled (the reference is given "
+             "the crossed zones, so timings aren't comparable)")
+    parser.add_argument(
+        '--backend', action='append', choices=sorted(BACKENDS),
+        help="Backend to check (default: all)")
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help="Replay every scenario this many times for timing")
+    args = parser.parse_args()
+
+    backends = args.backend or sorted(BACKENDS)
+    reference_time = 0.0
+    backend_times = dict.fromkeys(backends, 0.0)
+    mismatches = dict.fromkeys(backends, 0)
+    first_mismatches = {}
+    event_count = 0
+
+    for run in range(args.runs):
+        seed = args.seed + run
+        rng = Random(seed)
+        zones = random_zones(
+            rng, args.zones, args.teleport_chance, args.filter_chance)
+
+        players = random_players(rng, args.players)
+        player_masks = {player.index: player.mask for player in players}
+        events, expected = simulate(
+            rng, zones, players, args.ticks, args.swept, args.death_chance,
+            args.respawn_delay, args.round_restart_chance)
+
+        event_count += len(events)
+
+        # The reference replays the same stream so timings are comparable
+        outputs, elapsed = best_time(
+            lambda: run_reference_events(ReferenceReplay(), events, zones),
+            args.repeat)
+
+        assert outputs == expected, "Reference model isn't deterministic"
+        reference_time += elapsed
+
+        for name in backends:
+            outputs, elapsed = best_time(
+                lambda: run_events(
+                    BACKENDS[name](zones, player_masks, args.swept),
+                    events, zones),
+                args.repeat)
+
+            backend_times[name] += elapsed
+            for event, output, expected_output in zip(
+                    events, outputs, expected):
+
+                if not outputs_match(output, expected_output):
+                    mismatches[name] += 1
+                    first_mismatches.setdefault(
+                        name, (seed, event, output, expected_output))
+
+    print("{} scenarios, {} events, reference: {:.1f} ms".format(
+        args.runs, event_count, reference_time * 1000))
+
+    result = 0
+    for name in backends:
+        print("{}: {:.1f} ms, {:.2f}x the reference speed, {} "
+              "mismatches".format(
+                  name, backend_times[name] * 1000,
+                  reference_time / backend_times[name]
+                  if backend_times[name] else 0,
+                  mismatches[name]))
+
+        if mismatches[name]:
+            seed, event, output, expected_output = first_mismatches[name]
+            print("    first (seed {}): {} gave {}, expected {}".format(
+                seed, event, output, expected_output))
+
+            result = 1
+
+    return result
+
+
+if __name__ == '__main__':
+    sys.exit(main())
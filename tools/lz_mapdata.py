@@ -0,0 +1,139 @@
+"""Validate, lint and rewrite LimitZones mapdata files in parallel.
+
+Every file is checked against the zones schema used by the plugins, then
+linted for degenerate or inverted boxes, for filters that match no player
+and for zones made redundant by another zone with the same properties. Optionally the files are rewritten
+in normalised (sorted corners, indented) or compact (minified) form.
+"""
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import json
+from pathlib import Path
+import sys
+from time import perf_counter
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH / "addons" / "source-python" / "plugins"))
+
+from limit_zones.zone_data import (
+    lint_zones, load_zones, normalise_zone, ZoneDataError)
+
+
+MAPDATA_PATH = ROOT_PATH / "mapdata" / "limit_zones"
+
+REWRITE_NORMALISED = 'normalised'
+REWRITE_COMPACT = 'compact'
+
+
+def _process_file(path, rewrite, result):
+    with open(path, encoding='utf-8') as f:
+        json_dict = json.load(f)
+
+    zones = load_zones(json_dict)
+    result['zones'] = len(zones)
+    result['warnings'] = lint_zones(zones)
+
+    if rewrite is not None:
+        json_dict = {
+            'zones': [normalise_zone(zone_json)
+                      for zone_json in json_dict['zones']],
+        }
+
+        # Serialised before the file is opened, so a failure can't leave
+        # it truncated
+        if rewrite == REWRITE_COMPACT:
+            data = json.dumps(json_dict, separators=(',', ':'))
+        else:
+            data = json.dumps(json_dict, indent=4)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+
+        result['rewritten'] = True
+
+
+def process_file(path, rewrite=None):
+    start = perf_counter()
+    result = {
+        'path': path,
+        'zones': 0,
+        'error': None,
+        'warnings': [],
+        'rewritten': False,
+    }
+
+    try:
+        _process_file(path, rewrite, result)
+    except (OSError, ValueError, ZoneDataError) as e:
+        result['error'] = str(e)
+    except Exception as e:
+        # Anything the schema checks miss is still this file's error; it
+        # mustn't abort the run and hide the results of the other files
+        result['error'] = "unexpected {}: {}".format(type(e).__name__, e)
+        result['warnings'] = []
+
+    result['time'] = perf_counter() - start
+    return result
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        'paths', type=Path, nargs='*', default=[MAPDATA_PATH],
+        help="Files or directories to process (default: {})".format(
+            MAPDATA_PATH))
+    parser.add_argument(
+        '--rewrite', choices=(REWRITE_NORMALISED, REWRITE_COMPACT),
+        help="Rewrite valid files in the given form")
+    parser.add_argument(
+        '--jobs', type=int, default=None,
+        help="Number of worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if path.is_dir():
+            files.extend(sorted(path.glob("*.json")))
+        else:
+            files.append(path)
+
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(
+            process_file, files, [args.rewrite] * len(files),
+            chunksize=max(1, len(files) // 64)))
+
+    errors = warnings = zones = 0
+    for result in results:
+        zones += result['zones']
+        if result['error'] is not None:
+            errors += 1
+            status = "ERROR"
+        elif result['warnings']:
+            status = "WARN"
+        else:
+            status = "OK"
+
+        print("{status:5} {path} ({zones} zones, {time:.1f} ms{rewritten})"
+              "".format(
+                  status=status, path=result['path'], zones=result['zones'],
+                  time=result['time'] * 1000,
+                  rewritten=", rewritten" if result['rewritten'] else ""))
+
+        if result['error'] is not None:
+            print("      {}".format(result['error']))
+
+        for zone_id, message in result['warnings']:
+            warnings += 1
+            print("      zone #{}: {}".format(zone_id, message))
+
+    print("{files} files, {zones} zones: {errors} invalid, {warnings} "
+          "warnings in {time:.2f} s".format(
+              files=len(files), zones=zones, errors=errors,
+              warnings=warnings, time=perf_counter() - start))
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Replay a LimitZones trace (recorded with lz_trace_start) offline.
+
+Feeds the recorded touch events through the plugin's restriction logic,
+checks every run-command decision against the recorded one and reports
+the replay throughput. Traces carry the zones they were recorded against;
+only version 1 traces are replayed against a zones file.
+"""
+from argparse import ArgumentParser
+from collections import defaultdict
+import json
+from math import isnan
+from pathlib import Path
+import sys
+from time import perf_counter
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH / "addons" / "source-python" / "plugins"))
+
+from limit_zones.restrictions import PlayerRestrictions
+from limit_zones.trace import (
+    read_trace, RECORD_END_TOUCH, RECORD_RUN_COMMAND, RECORD_START_TOUCH)
+from limit_zones.zone_data import load_zones
+
+
+MAPDATA_PATH = ROOT_PATH / "mapdata" / "limit_zones"
+
+
+def replay(records, zones, backend=PlayerRestrictions):
+    restrictions = defaultdict(backend)
+    mismatches = []
+
+    for record in records:
+        record_type = record[0]
+        if record_type == RECORD_RUN_COMMAND:
+            tick, index, buttons_in, buttons_out, speed_cap = record[1:]
+            player_restrictions = restrictions[index]
+
+            if isnan(speed_cap):
+                speed_cap = None
+
+            replayed_cap = player_restrictions.speed_cap
+            if (player_restrictions.filter_buttons(buttons_in) != buttons_out
+                    or replayed_cap != speed_cap):
+
+                mismatches.append(record)
+
+        elif record_type == RECORD_START_TOUCH:
+            tick, index, zone_id = record[1:]
+            player_restrictions = restrictions[index]
+            player_restrictions.start_touch(zones[zone_id])
+
+        elif record_type == RECORD_END_TOUCH:
+            tick, index, zone_id = record[1:]
+            player_restrictions = restrictions[index]
+            player_restrictions.end_touch(zones[zone_id])
+
+    return mismatches
+
+
+def _zone_keys(zones_json):
+    return [json.dumps(zone_json, sort_keys=True) for zone_json in zones_json]
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace', type=Path)
+    parser.add_argument(
+        '--zones', type=Path,
+        help="Zones file to check the recorded zones against, or to replay "
+             "a version 1 trace against (default: the map's file in "
+             "{})".format(MAPDATA_PATH))
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help="Replay the trace this many times for timing")
+    args = parser.parse_args()
+
+    map_name, zones_json, records = read_trace(args.trace)
+    if zones_json is None or args.zones is not None:
+        zones_path = args.zones or MAPDATA_PATH / "{}.json".format(map_name)
+        with open(zones_path) as f:
+            file_json = json.load(f)
+
+        # Zone IDs are positions, so any edit since would replay the
+        # touches against the wrong zones
+        if zones_json is not None and (
+                _zone_keys(file_json['zones']) != _zone_keys(zones_json)):
+
+            print("{}: zones differ from the ones {} was recorded "
+                  "against".format(zones_path, args.trace))
+            return 1
+
+        zones = load_zones(file_json)
+    else:
+        zones = load_zones({'zones': zones_json})
+
+    print("{}: map {}, {} records, {} zones".format(
+        args.trace, map_name, len(records), len(zones)))
+
+    best = None
+    for i in range(args.repeat):
+        start = perf_counter()
+        mismatches = replay(records, zones)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print("Best of {}: {:.3f} ms, {:.0f} records/s".format(
+        args.repeat, best * 1000, len(records) / best if best else 0))
+
+    if mismatches:
+        print("{} run-command decisions differ from the recording, "
+              "first: {}".format(len(mismatches), mismatches[0]))
+        return 1
+
+    print("All run-command decisions match the recording")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())